@@ -1,279 +1,374 @@
 ###
 # Script for plotting and animating both PurpleAir and AQY data from a controlled experiment
-# across multiple rounds. If a similar experiment is performed in the future, the filenames
-# and round times can be subsituted into the global variables at the top of the script to
-# produce new plots
+# across multiple rounds. Each experiment is described by an experiment.json in its data
+# directory (files, round times, sensor distances; see Experiment). If a similar
+# experiment is performed in the future, write a spec for its data directory and
+# run_batch will produce its plots along with those of every other experiment
 ###
 
+import os
+import sys
+import glob
+import json
+import subprocess
+import time
 import pandas as pd
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from datetime import timedelta
 from pytz import timezone
-from scipy import interpolate
 
-S1 = "exp5_data/PA1.csv" #  0  0  0  0
-S2 = "exp5_data/PA2.csv" #  2  6 10 14
-S3 = "exp5_data/PA2.csv" #  4  8 12 16
-S4 = "exp5_data/PA4.csv" # 30 30 30 30
-AERO_EXHAUST = "exp5_data/AQY BD-1160 Data Export.csv"
-AERO_DISTANT = "exp5_data/AQY BD-1161 Data Export.csv" # 30 4 8 12 16
-
-# Start, End times for each round
-ROUND_TIMES =  {1: ["16:28:54", "16:55:00"],
-                2: ["15:07:52", "15:22:54"],
-                3: ["15:32:28", "15:47:05"],
-                4: ["15:58:46", "16:12:19"]}
-
-GLOBAL_START = datetime.strptime("15:00:00", "%H:%M:%S").replace(tzinfo=timezone('US/Pacific'))
-
-R1 = [datetime.strptime(ROUND_TIMES[1][0], "%H:%M:%S").replace(tzinfo=timezone('US/Pacific')), \
-      datetime.strptime(ROUND_TIMES[1][1], "%H:%M:%S").replace(tzinfo=timezone('US/Pacific'))]
-R2 = [datetime.strptime(ROUND_TIMES[2][0], "%H:%M:%S").replace(tzinfo=timezone('US/Pacific')), \
-      datetime.strptime(ROUND_TIMES[2][1], "%H:%M:%S").replace(tzinfo=timezone('US/Pacific'))]
-R3 = [datetime.strptime(ROUND_TIMES[3][0], "%H:%M:%S").replace(tzinfo=timezone('US/Pacific')), \
-      datetime.strptime(ROUND_TIMES[3][1], "%H:%M:%S").replace(tzinfo=timezone('US/Pacific'))]
-R4 = [datetime.strptime(ROUND_TIMES[4][0], "%H:%M:%S").replace(tzinfo=timezone('US/Pacific')), \
-      datetime.strptime(ROUND_TIMES[4][1], "%H:%M:%S").replace(tzinfo=timezone('US/Pacific'))]
-
-round_list = [R1, R2, R3, R4]
-
-R2_RANGE = [datetime.strptime("15:02:00", "%H:%M:%S").replace(tzinfo=timezone('US/Pacific')), \
-      datetime.strptime("15:28:00", "%H:%M:%S").replace(tzinfo=timezone('US/Pacific'))]
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import frames
+import channels
+import roundratios
+import sensorseries
+import store
+import timeparse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Spec of the experiment used when a function is not given one
+EXPERIMENT = os.path.join(HERE, "exp5_data", "experiment.json")
+SPEC_PATTERN = os.path.join(HERE, "exp*_data", "experiment.json")
+
+# Where run_batch saves each experiment's plots, apart from the report figures in the
+# exp*_figs directories (gitignored)
+OUTPUT_DIR = os.path.join(HERE, "batch_output")
+
+AQY_FORMAT = "%m/%d/%Y %H:%M"
+AQY_PARAMS = ["PM2.5 (µg/m³)", "NO2 (ppb)", "O3 (ppb)"] # AQY columns read from the store
+
+def toTime(clock):
+    return datetime.strptime(clock, "%H:%M:%S").replace(tzinfo=timezone('US/Pacific'))
+
+class Experiment:
+    """ One controlled experiment. The spec is a dict (the contents of an experiment.json)
+    with the keys
+        start: time of day the plots start from, e.g. "15:00:00"
+        purple_air, aeroqual: sensor label -> csv name in directory
+        rounds: round number -> [start, end] times of day (may be empty)
+        distances: PurpleAir label -> its distance from the vehicle in ft, each round
+        source, reference: PurpleAir labels of the sensors by the exhaust and far away
+        ratio_rounds: rounds to draw ratio curves for (all rounds by default)
+        zoom: {"round": number, "range": [start, end]} window shown by fig4
+        animate_round: round shown by animate
+        output: directory in OUTPUT_DIR that run_batch saves plots in (name by default)
+        clock_offset: minutes subtracted from the PurpleAir times (7 by default) """
+
+    def __init__(self, spec, directory):
+        self.name = spec.get("name", os.path.basename(directory))
+        self.directory = directory
+        self.start = toTime(spec["start"])
+        self.clockOffset = spec.get("clock_offset", 7)
+        self.purpleAir = {label: os.path.join(directory, f) for label, f in spec["purple_air"].items()}
+        self.aeroqual = {label: os.path.join(directory, f) for label, f in spec["aeroqual"].items()}
+        self.rounds = {int(n): [toTime(a), toTime(b)] for n, (a, b) in spec.get("rounds", {}).items()}
+        self.distances = spec.get("distances", {})
+        self.source = spec.get("source")
+        self.reference = spec.get("reference")
+        self.ratioRounds = spec.get("ratio_rounds", sorted(self.rounds))
+        zoom = spec.get("zoom")
+        self.zoomRound = zoom["round"] if zoom else None
+        self.zoomRange = [toTime(x) for x in zoom["range"]] if zoom else None
+        self.animateRound = spec.get("animate_round", min(self.rounds) if self.rounds else None)
+        self.output = os.path.join(OUTPUT_DIR, spec.get("output", self.name))
+
+    @classmethod
+    def load(cls, path):
+        """ Reads the spec at path. File names in it are relative to its directory """
+        with open(path, encoding="utf-8") as f:
+            spec = json.load(f)
+        return cls(spec, os.path.dirname(os.path.abspath(path)))
+
+    def roundList(self):
+        """ Returns the [start, end] times of rounds 1, 2, ... in order """
+        return [self.rounds[n] for n in sorted(self.rounds)]
+
+_experiments = {}
+
+def getExperiment(experiment = None):
+    """ Returns experiment, or the experiment in EXPERIMENT if it is None """
+    if experiment is not None:
+        return experiment
+    if EXPERIMENT not in _experiments:
+        _experiments[EXPERIMENT] = Experiment.load(EXPERIMENT)
+    return _experiments[EXPERIMENT]
+
+def showOrSave(path = None):
+    """ Shows the current figure, or saves it to path and closes it """
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path)
+        plt.close()
 
 def dateToMinutes(start, date):
     delta = date - start
     secs = delta.total_seconds()
     return secs/60
 
-def purple_air_full(filename):
-    df = pd.read_csv(filename)
-    pm = df["pm2_5_atm"].tolist()
-    times = [x[-9:-1] for x in df["UTCDateTime"].tolist()]
-    dates = [datetime.strptime(x, "%H:%M:%S") for x in times]
-    utcTimes = [x.replace(tzinfo=timezone('UTC')) for x in dates]
-    pstTimes = [x.astimezone(timezone('US/Pacific'))-timedelta(minutes=7) for x in utcTimes]
-    for i in range(len(pstTimes)):
-        if pstTimes[i].day == 31:
-            pstTimes[i] = pstTimes[i]+timedelta(days=1)
-    return [pm, [dateToMinutes(GLOBAL_START, x) for x in pstTimes]]
-
-S1F = purple_air_full(S1)
-S2F = purple_air_full(S2)
-S3F = purple_air_full(S3)
-S4F = purple_air_full(S4)
-
-def purple_air(filename, timeRange = None):
-    df = pd.read_csv(filename)
-    pm = df["pm2_5_atm"].tolist()
-    times = [x[-9:-1] for x in df["UTCDateTime"].tolist()]
-    dates = [datetime.strptime(x, "%H:%M:%S") for x in times]
-    utcTimes = [x.replace(tzinfo=timezone('UTC')) for x in dates]
-    pstTimes = [x.astimezone(timezone('US/Pacific'))-timedelta(minutes=7) for x in utcTimes]
-    for i in range(len(pstTimes)):
-        if pstTimes[i].day == 31:
-            pstTimes[i] = pstTimes[i]+timedelta(days=1)
+def sensorId(filename):
+    """ The sensor_id in the store of an experiment csv, e.g. "exp5_data/PA1" """
+    return os.path.basename(os.path.dirname(filename)) + "/" + os.path.splitext(os.path.basename(filename))[0]
+
+def ingestPurpleAir(db, filename):
+    """ Adds a PurpleAir log to the store as "A" and "B" channels. The full timestamps
+    are stored; the readers below reduce them to times of day as before """
+    epoch, columns = store.read_csv(filename, "UTCDateTime", timeparse.SD_CARD_FORMAT)
+    a, b = channels.split_columns(columns)
+    db.insert(sensorId(filename), "A", epoch, a)
+    db.insert(sensorId(filename), "B", epoch, b)
+
+def ingestAeroqual(db, filename):
+    """ Adds an AQY export to the store """
+    epoch, columns = store.read_csv(filename, "Time", AQY_FORMAT, timeparse.LOCAL_TZ)
+    db.insert(sensorId(filename), store.MAIN_CHANNEL, epoch, columns)
+
+def ingest(db):
+    """ Adds the csvs of every experiment matching SPEC_PATTERN that are new or changed
+    since the last ingest to the store. Returns their paths """
+    done = []
+    for specPath in sorted(glob.glob(SPEC_PATTERN)):
+        experiment = Experiment.load(specPath)
+        done += store.ingest_files(db, sorted(set(experiment.purpleAir.values())), ingestPurpleAir)
+        done += store.ingest_files(db, sorted(set(experiment.aeroqual.values())), ingestAeroqual)
+    return done
+
+# Parsed csvs, keyed by filename. Files are only read when a figure first needs them,
+# and every figure of an experiment shares them
+_loaded = {}
+
+def purple_air_times(filename, clockOffset = 7):
+    """ Returns the pm2_5_atm SensorSeries of the PurpleAir csv in time order (epoch
+    seconds less clockOffset minutes), parsing it the first time it is asked for. Only
+    the time of day is kept, on 1 Jan 1900 local time like toTime. Reads the store if
+    there is one """
+    if (filename, clockOffset) in _loaded:
+        return _loaded[(filename, clockOffset)]
+    db = store.default()
+    if db is not None:
+        store.ingest_files(db, [filename], ingestPurpleAir)
+        cols = db.query(sensorId(filename), "A", ["pm2_5_atm"], dropna=False)
+        pm = cols["pm2_5_atm"]
+        clock = pd.Series(pd.to_timedelta(cols["epoch"] % 86400, unit="s"))
+    else:
+        df = pd.read_csv(filename)
+        pm = df["pm2_5_atm"].to_numpy(dtype=float)
+        clock = pd.to_timedelta(df["UTCDateTime"].str[-9:-1])
+    utcTimes = (pd.Timestamp("1900-01-01") + clock).dt.tz_localize("UTC")
+    pstTimes = utcTimes.dt.tz_convert("US/Pacific") - pd.Timedelta(minutes=clockOffset)
+    # times after midnight UTC fall on 31 Dec 1899 in Pacific time
+    pstTimes = pstTimes.where(pstTimes.dt.day != 31, pstTimes + pd.Timedelta(days=1))
+    epoch = (pstTimes.dt.tz_convert("UTC").dt.tz_localize(None) - datetime(1970, 1, 1)).dt.total_seconds().to_numpy()
+    if np.any(epoch[1:] < epoch[:-1]):
+        order = np.argsort(epoch, kind="stable")
+        pm, epoch = pm[order], epoch[order]
+    series = sensorseries.SensorSeries(epoch, pm, os.path.basename(filename), "pm2_5_atm")
+    _loaded[(filename, clockOffset)] = series
+    return series
+
+def purple_air_full(filename, experiment = None):
+    """ The PurpleAir SensorSeries over the whole experiment """
+    return purple_air_times(filename, getExperiment(experiment).clockOffset)
+
+def windowEpochs(windows):
+    """ The start and end epoch seconds of the [start, end] datetime windows """
+    return [start.timestamp() for start, _ in windows], [end.timestamp() for _, end in windows]
+
+def purple_air(filename, timeRange = None, experiment = None):
+    """ Returns the PurpleAir SensorSeries within the [start, end] datetimes timeRange,
+    or if it is None, within each round of the experiment. The series view the arrays of
+    the whole file """
+    experiment = getExperiment(experiment)
+    series = purple_air_times(filename, experiment.clockOffset)
     if timeRange != None:
-        newVals = []
-        newPstTimes = []
-        for i in range(len(pstTimes)):
-            date = pstTimes[i]
-            if timeRange[0] < date and date < timeRange[1]:
-                newVals.append(pm[i])
-                newPstTimes.append(dateToMinutes(timeRange[0], date))
-        return (newPstTimes, newVals)
-    rounds = []
-    for _ in range(5):
-        rounds.append([[], []])
-    for i in range(len(pstTimes)):
-        date = pstTimes[i]
-        if R1[0] < date and date < R1[1]:
-            rounds[0][0].append(pm[i])
-            rounds[0][1].append(dateToMinutes(R1[0], date))
-        elif R2[0] < date and date < R2[1]:
-            rounds[1][0].append(pm[i])
-            rounds[1][1].append(dateToMinutes(R2[0], date))
-        elif R3[0] < date and date < R3[1]:
-            rounds[2][0].append(pm[i])
-            rounds[2][1].append(dateToMinutes(R3[0], date))
-        elif R4[0] < date and date < R4[1]:
-            rounds[3][0].append(pm[i])
-            rounds[3][1].append(dateToMinutes(R4[0], date))
-    return rounds
-
-S1R = purple_air(S1)
-S2R = purple_air(S2)
-S3R = purple_air(S3)
-S4R = purple_air(S4)
+        return series.window(timeRange[0].timestamp(), timeRange[1].timestamp())
+    return series.windows(*windowEpochs(experiment.roundList()))
 
 def subtract(xR, yR):
-    f = interpolate.interp1d(yR[1], yR[0], fill_value='extrapolate')
-    yInterp = f(xR[1])
-    return [a - b for a, b in zip(xR[0], yInterp)]
-
-def subtractTest():
-    plt.plot(S1R[0][1], S1R[0][0])
-    testY = [[x+100 for x in S1R[0][0]], [y+4 for y in S1R[0][1]]]
-    plt.plot(testY[1], testY[0])
-    plt.plot(S1R[0][1], subtract(S1R[0], testY))
+    """ xR - yR, with yR linearly interpolated to the times of xR (nan beyond its ends) """
+    return xR - yR
+
+def subtractTest(experiment = None):
+    experiment = getExperiment(experiment)
+    S1R = purple_air(experiment.purpleAir["1"], experiment=experiment)
+    start = experiment.roundList()[0][0].timestamp()
+    plt.plot(S1R[0].minutes(start), S1R[0].values)
+    testY = sensorseries.SensorSeries(S1R[0].epoch + 240, S1R[0].values + 100)
+    plt.plot(testY.minutes(start), testY.values)
+    plt.plot(S1R[0].minutes(start), subtract(S1R[0], testY).values)
     plt.show()
 
 def divide(xR, yR):
-    f = interpolate.interp1d(yR[1], yR[0], fill_value='extrapolate')
-    yInterp = f(xR[1])
-    return [a / b for a, b in zip(xR[0], yInterp)]
-
-def testPlot():
-    plt.plot(S1R[2][1], S1R[2][0])
-    plt.plot(S3R[2][1], S3R[2][0])
-    plt.plot(S4R[2][1], S4R[2][0])
+    """ xR / yR, with yR linearly interpolated to the times of xR (nan beyond its ends) """
+    return xR / yR
+
+def testPlot(experiment = None):
+    experiment = getExperiment(experiment)
+    S1R, S3R, S4R = [purple_air(experiment.purpleAir[x], experiment=experiment) for x in ["1", "3", "4"]]
+    start = experiment.roundList()[2][0].timestamp()
+    for S in [S1R, S3R, S4R]:
+        plt.plot(S[2].minutes(start), S[2].values)
     plt.legend(["1", "3", "4"])
     plt.show()
 
-def s2_ratios():
-    r2s2sub = [subtract(S2R[1], S4R[1]), S2R[1][1]]
-    r2s1sub = [subtract(S1R[1], S4R[1]), S1R[1][1]]
-    r2div = divide(r2s2sub, r2s1sub)
-    plt.plot(S2R[1][1], r2div)
-
-    r3s2sub = [subtract(S2R[2], S4R[2]), S2R[2][1]]
-    r3s1sub = [subtract(S1R[2], S4R[2]), S1R[2][1]]
-    r3div = divide(r3s2sub, r3s1sub)
-    plt.plot(S2R[2][1], r3div)
-
-    r4s2sub = [subtract(S2R[3], S4R[3]), S2R[3][1]]
-    r4s1sub = [subtract(S1R[3], S4R[3]), S1R[3][1]]
-    r4div = divide(r4s2sub, r4s1sub)
-    plt.plot(S2R[3][1], r4div)
-
-    plt.legend(["Round 2 (2 ft)", "Round 3 (6 ft)", "Round 4 (10 ft)"])
-    plt.show()
-
-def s3_ratios():
-    r2s3sub = [subtract(S3R[1], S4R[1]), S3R[1][1]]
-    r2s1sub = [subtract(S1R[1], S4R[1]), S1R[1][1]]
-    r2div = divide(r2s3sub, r2s1sub)
-    plt.plot(S3R[1][1], r2div)
-
-    r3s3sub = [subtract(S3R[2], S4R[2]), S3R[2][1]]
-    r3s1sub = [subtract(S1R[2], S4R[2]), S1R[2][1]]
-    r3div = divide(r3s3sub, r3s1sub)
-    plt.plot(S3R[2][1], r3div)
-
-    r4s3sub = [subtract(S3R[3], S4R[3]), S3R[3][1]]
-    r4s1sub = [subtract(S1R[3], S4R[3]), S1R[3][1]]
-    r4div = divide(r4s3sub, r4s1sub)
-    plt.plot(S3R[3][1], r4div)
-
-    plt.legend(["Round 2 (4 ft)", "Round 3 (8 ft)", "Round 4 (12 ft)"])
-    plt.show()
-
-def aero(filename, param, plot=True, timeRange=None):
-    df = pd.read_csv(filename)
-    vals = df[param].tolist()
-    times = [x[-5:] for x in df["Time"].tolist()]
-    dates = [datetime.strptime(x, "%H:%M") for x in times]
-    pstTimes = [x.replace(tzinfo=timezone('US/Pacific')) for x in dates]
-    for i in range(len(pstTimes)):
-        if pstTimes[i].day == 31:
-            pstTimes[i] = pstTimes[i]+timedelta(days=1)
+def roundRatios(experiment = None, step = roundratios.STEP):
+    """ Returns the RoundRatios of every PurpleAir sensor of the experiment over all its
+    rounds, on a grid step seconds apart. Computed once per experiment and step """
+    experiment = getExperiment(experiment)
+    key = ("ratios", experiment.directory, step)
+    if key not in _loaded:
+        series = {label: purple_air_times(filename, experiment.clockOffset) for label, filename in experiment.purpleAir.items()}
+        windows = {n: (start.timestamp(), end.timestamp()) for n, (start, end) in experiment.rounds.items()}
+        _loaded[key] = roundratios.RoundRatios.from_series(series, windows, experiment.source, experiment.reference, step)
+    return _loaded[key]
+
+def ratios(label, experiment = None, path = None):
+    """ Plots, for each of the experiment's ratio rounds, the PM2.5 of the labelled sensor
+    above the reference sensor divided by that of the source sensor (see roundRatios).
+    Returns the [minutes, ratios] curve of each round """
+    experiment = getExperiment(experiment)
+    result = roundRatios(experiment)
+    curves = []
+    legend = []
+    for n in experiment.ratioRounds:
+        curves.append(list(result.curve(label, n)))
+        plt.plot(*curves[-1])
+        legend.append("Round %d (%g ft)" % (n, experiment.distances[label][n-1]))
+    plt.legend(legend)
+    showOrSave(path)
+    return curves
+
+def s2_ratios(experiment = None):
+    return ratios("2", experiment)
+
+def s3_ratios(experiment = None):
+    return ratios("3", experiment)
+
+def aero_times(filename):
+    """ Returns the AQY csv as a DataFrame and its times (epoch seconds of the time of day
+    on 1 Jan 1900 local time, like toTime), parsing it the first time it is asked for.
+    Reads the AQY_PARAMS columns from the store if there is one """
+    if filename in _loaded:
+        return _loaded[filename]
+    db = store.default()
+    if db is not None:
+        store.ingest_files(db, [filename], ingestAeroqual)
+        cols = db.query(sensorId(filename), store.MAIN_CHANNEL, AQY_PARAMS, dropna=False)
+        df = pd.DataFrame({param: cols[param] for param in AQY_PARAMS})
+        local = timeparse.local_times(cols["epoch"])
+        clock = (local.hour * 3600 + local.minute * 60).to_numpy(dtype=float)
+    else:
+        df = pd.read_csv(filename)
+        clock = pd.to_timedelta(df["Time"].str[-5:] + ":00").dt.total_seconds().to_numpy()
+    epoch = toTime("00:00:00").timestamp() + clock
+    if np.any(epoch[1:] < epoch[:-1]):
+        order = np.argsort(epoch, kind="stable")
+        df, epoch = df.iloc[order].reset_index(drop=True), epoch[order]
+    _loaded[filename] = (df, epoch)
+    return df, epoch
+
+def aero_series(filename, param):
+    """ The SensorSeries of param in the AQY csv """
+    df, epoch = aero_times(filename)
+    return sensorseries.SensorSeries(epoch, df[param].to_numpy(dtype=float), os.path.basename(filename), param)
+
+def aero(filename, param, plot=True, timeRange=None, experiment=None):
+    """ Returns the minutes (from the start of timeRange, or of the experiment) and values
+    of param in the AQY csv, plotting them unless plot is False """
+    series = aero_series(filename, param)
     if timeRange != None:
-        newVals = []
-        newPstTimes = []
-        for i in range(len(pstTimes)):
-            date = pstTimes[i]
-            if timeRange[0] < date and date < timeRange[1]:
-                newVals.append(vals[i])
-                newPstTimes.append(dateToMinutes(timeRange[0], date))
-        vals = newVals
-        pstTimes = newPstTimes
+        series = series.window(timeRange[0].timestamp(), timeRange[1].timestamp())
+        start = timeRange[0].timestamp()
     else:
-        pstTimes = [dateToMinutes(GLOBAL_START, x) for x in pstTimes]
+        start = getExperiment(experiment).start.timestamp()
+    pstTimes = series.minutes(start)
     if plot:
-        plt.plot(pstTimes, vals)
-    return pstTimes, vals
+        plt.plot(pstTimes, series.values)
+    return pstTimes, series.values
 
-def fig1():
+def fig1(experiment = None, path = None):
     """ Plots PM2.5 levels over the entire experiment for each PurpleAir and AQY sensor """
-    plt.plot(S1F[1], S1F[0])
-    plt.plot(S2F[1], S2F[0])
-    plt.plot(S4F[1], S4F[0])
-    aero(AERO_EXHAUST, "PM2.5 (µg/m³)")
-    aero(AERO_DISTANT, "PM2.5 (µg/m³)")
-    addTimeLines(GLOBAL_START)
-    plt.legend(["PurpleAir 1", "PurpleAir 2", "PurpleAir 4", "Aeroqual Exhaust", "Aeroqual Distant"])
+    experiment = getExperiment(experiment)
+    legend = []
+    plotted = set()
+    for label, filename in experiment.purpleAir.items():
+        if filename not in plotted: # a file may be listed under several labels
+            S = purple_air_full(filename, experiment)
+            plt.plot(S.minutes(experiment.start.timestamp()), S.values)
+            legend.append("PurpleAir " + label)
+            plotted.add(filename)
+    for label, filename in experiment.aeroqual.items():
+        aero(filename, "PM2.5 (µg/m³)", experiment=experiment)
+        legend.append("Aeroqual " + label.title())
+    addTimeLines(experiment.start, experiment=experiment)
+    plt.legend(legend)
     plt.xlabel("Time [mins]")
     plt.ylabel("PM$_{2.5}$ Concentration [$\mu$g/m$^3$]")
     plt.title("PM$_{2.5}$ Measurements")
-    plt.show()
+    showOrSave(path)
 
-def fig2():
+def fig2(experiment = None, path = None):
     """ Plots NO2 levels over the entire experiment for each AQY sensor """
-    aero(AERO_EXHAUST, "NO2 (ppb)")
-    aero(AERO_DISTANT, "NO2 (ppb)")
-    addTimeLines(GLOBAL_START)
-    plt.legend(["Exhaust", "Distant"])
+    experiment = getExperiment(experiment)
+    for filename in experiment.aeroqual.values():
+        aero(filename, "NO2 (ppb)", experiment=experiment)
+    addTimeLines(experiment.start, experiment=experiment)
+    plt.legend([label.title() for label in experiment.aeroqual])
     plt.title("Aeroqual NO2 Measurements")
     plt.xlabel("Time [mins]")
     plt.ylabel("NO2 Concentration [ppb]")
-    plt.show()
+    showOrSave(path)
 
-def fig3():
+def fig3(experiment = None, path = None):
     """ Plots O3 levels over the entire experiment for each AQY sensor """
-    aero(AERO_EXHAUST, "O3 (ppb)")
-    aero(AERO_DISTANT, "O3 (ppb)")
-    addTimeLines(GLOBAL_START)
-    plt.legend(["Exhaust", "Distant"])
+    experiment = getExperiment(experiment)
+    for filename in experiment.aeroqual.values():
+        aero(filename, "O3 (ppb)", experiment=experiment)
+    addTimeLines(experiment.start, experiment=experiment)
+    plt.legend([label.title() for label in experiment.aeroqual])
     plt.title("Aeroqual O3 Measurements")
     plt.xlabel("Time [mins]")
     plt.ylabel("O3 Concentration [ppb]")
-    plt.show()
+    showOrSave(path)
 
-def fig4():
-    """ Plots PM2.5 measurements for sensors 1 and 4 during round 2 """
+def fig4(experiment = None, path = None):
+    """ Plots PM2.5 measurements for the source and reference sensors around the zoom round """
+    experiment = getExperiment(experiment)
     fig, ax = plt.subplots()
-    S1X, S1Y = purple_air(S1, R2_RANGE)
-    S4X, S4Y = purple_air(S4, R2_RANGE)
-    plt.plot(S1X, S1Y)
-    plt.plot(S4X, S4Y)
+    legend = []
+    for label in [experiment.source, experiment.reference]:
+        S = purple_air(experiment.purpleAir[label], experiment.zoomRange, experiment)
+        plt.plot(S.minutes(experiment.zoomRange[0].timestamp()), S.values)
+        legend.append("%g ft from vehicle" % experiment.distances[label][experiment.zoomRound-1])
     ax.set_ylim(-20, 200)
-    addGray(ax, R2_RANGE[0], [2])
-    plt.legend(["1 ft from vehicle", "30 ft from vehicle"])
+    addGray(ax, experiment.zoomRange[0], [experiment.zoomRound], experiment)
+    plt.legend(legend)
     plt.xlabel("Time [mins]")
     plt.ylabel("PM$_{2.5}$ Concentration [$\mu$g/m$^3$]")
     plt.title("PM$_{2.5}$ by Distance")
-    plt.show()
-
-def addTimeLines(start, rounds = [1, 2, 3, 4]):
-    for i in rounds:
-        plt.axvline(x=dateToMinutes(start, round_list[i-1][0]), color=(1, 0, 0))
-        plt.axvline(x=dateToMinutes(start, round_list[i-1][1]), color=(0, 0, 1))
-
-def addGray(ax, start, rounds = [1, 2, 3, 4]):
-    for i in rounds:
-        ax.axvspan(dateToMinutes(start, round_list[i-1][0]), dateToMinutes(start, round_list[i-1][1]), alpha=0.2, color='gray')
-
-def getInterpPoints(x1, y1, x2, y2, numPoints):
-    """ Outputs numPoints interpolated points from [x1, x2) """
-    Xs = []
-    for i in range(numPoints):
-        newX = x1 + (i * (x2-x1) / numPoints)
-        Xs.append(newX)
-    Ys = []
-    f = interpolate.interp1d([x1, x2], [y1, y2], fill_value='extrapolate')
-    for x in Xs:
-        Ys.append(f(x).item())
-    return Xs, Ys
-
-def animate(framerate=60, speedMultiplier=2):
-    """ Generates an animation of NO2 concentration over time for both AQY sensors """
-    plt.rcParams['animation.ffmpeg_path'] = 'C:\\ffmpeg\\bin\\ffmpeg.exe'
-
+    showOrSave(path)
+
+def addTimeLines(start, rounds = None, experiment = None):
+    experiment = getExperiment(experiment)
+    for i in rounds or sorted(experiment.rounds):
+        plt.axvline(x=dateToMinutes(start, experiment.rounds[i][0]), color=(1, 0, 0))
+        plt.axvline(x=dateToMinutes(start, experiment.rounds[i][1]), color=(0, 0, 1))
+
+def addGray(ax, start, rounds = None, experiment = None):
+    experiment = getExperiment(experiment)
+    for i in rounds or sorted(experiment.rounds):
+        ax.axvspan(dateToMinutes(start, experiment.rounds[i][0]), dateToMinutes(start, experiment.rounds[i][1]), alpha=0.2, color='gray')
+
+def animate(framerate=60, speedMultiplier=2, interpolation="linear", ffmpeg=None, workers=1, experiment=None):
+    """ Generates an animation of NO2 concentration over time for both AQY sensors during
+    the experiment's animate round. Each sample is upsampled to framerate frames, joined
+    by straight lines ("linear") or a monotone cubic ("pchip"). The frames are rendered
+    off screen and encoded with ffmpeg (see frames.render) """
+    experiment = getExperiment(experiment)
     fig, ax = plt.subplots()
-    xdata, ydata = [], []
-    ln, = plt.plot([], [], color=(0, 0, 0))
 
     size = 15
     fig.set_size_inches(size, size/1.777)
@@ -282,75 +377,84 @@ def animate(framerate=60, speedMultiplier=2):
     plt.xlabel("Time [mins]")
     plt.title("NO$_{2}$ Concentration Over Time")
 
-    locs1, vals1 = aero(AERO_EXHAUST, "NO2 (ppb)", False, R1)
-    locs2, vals2 = aero(AERO_DISTANT, "NO2 (ppb)", False, R1)
+    window = experiment.rounds[experiment.animateRound]
+    locs1, vals1 = aero(experiment.aeroqual["exhaust"], "NO2 (ppb)", False, window)
+    locs2, vals2 = aero(experiment.aeroqual["distant"], "NO2 (ppb)", False, window)
 
     dataPreInterp = [[locs1, vals1], [locs2, vals2]]
-    data = []
-
-    for line in dataPreInterp:
-        Xs, Ys = [], []
-        for i in range(len(line[0])-1):
-            interp = getInterpPoints(line[0][i], line[1][i], line[0][i+1], line[1][i+1], framerate)
-            Xs.extend(interp[0])
-            Ys.extend(interp[1])
-        Xs.append(line[0][-1])
-        Ys.append(line[1][-1])
-        data.append([Xs, Ys])
-    
-    xyData = [[[], []], [[], []]]
+    data = [frames.upsample(x, y, framerate, interpolation) for x, y in dataPreInterp]
 
     colors = [(0.796875, 0.14453125, 0.16015625), (0.22265625, 0.4140625, 0.69140625)]
-    
-    lines = []
-    for index in range(len(data)):
-        lobj = ax.plot([],[],lw=2,color=colors[index])[0]
-        lines.append(lobj)
-    
-    def initTest():
-        ax.set_xlim(-20, len(locs1)+10)
-        ax.set_ylim(-10, 100)
-        return ln,
-    
-    def frameTest(i):
-        xdata.append(data[0][0][i])
-        ydata.append(data[0][1][i])
-        ln.set_data(xdata, ydata)
-        return ln,
-    
-    def init():
-        ax.set_xlim(-2, len(locs1)+2)
-        ax.set_ylim(-2, 80)
-        for line in lines:
-            line.set_data([],[])
-        legend = plt.legend(["1 ft from vehicle", "30 ft from vehicle"], loc="upper left")
-        for i in range(len(data)):
-            legend.legendHandles[i].set_color(colors[i])
-        return lines
-
-    def frame(i):
-        for n in range(len(data)):
-            if i < len(data[n][0]) and i < len(data[n][1]):
-                xyData[n][0].append(data[n][0][i])
-                xyData[n][1].append(data[n][1][i])
-        for n in range(len(lines)):
-            if i < len(data[n][0]) and i < len(data[n][1]):
-                lines[n].set_data(xyData[n][0], xyData[n][1])
-        legend = plt.legend(["1 ft from vehicle", "30 ft from vehicle"], loc="upper left")
-        for i in range(len(data)):
-            legend.legendHandles[i].set_color(colors[i])
-        return lines + [legend]
-    
-    anim = animation.FuncAnimation(fig, frame, init_func=init,
-                                frames=len(data[0][0]), interval=20, blit=True)
-    
-    FFMpegWriter = animation.writers['ffmpeg']
-    writer = FFMpegWriter(fps=framerate*speedMultiplier, metadata=dict(artist='Me'), bitrate=1800)
-    
-    anim.save('basic_animation_exp4.mp4', writer=writer)
+    lines = [ax.plot([], [], lw=2, color=color)[0] for color in colors]
+
+    ax.set_xlim(-2, len(locs1)+2)
+    ax.set_ylim(-2, 80)
+    ax.legend(lines, ["1 ft from vehicle", "30 ft from vehicle"], loc="upper left")
+
+    path = 'basic_animation_' + experiment.name + '.mp4'
+    frames.render(fig, lines, data, path, framerate*speedMultiplier, ffmpeg, workers=workers)
+    plt.close(fig)
+
+def process(specPath):
+    """ Loads the experiment described by the spec at specPath and saves its figures and
+    ratio curves (when it has rounds, also exported as ratios.npz and ratios.csv) to its
+    output directory. Returns the experiment name and a dict mapping each PurpleAir label
+    to its ratio curves (see ratios) """
+    plt.switch_backend("Agg")
+    experiment = Experiment.load(specPath)
+    os.makedirs(experiment.output, exist_ok=True)
+    output = lambda name: os.path.join(experiment.output, name)
+    fig1(experiment, output("pm25.png"))
+    fig2(experiment, output("no2.png"))
+    fig3(experiment, output("o3.png"))
+    curves = {}
+    if experiment.zoomRound is not None:
+        fig4(experiment, output("zoom.png"))
+    if experiment.rounds and experiment.source and experiment.reference:
+        result = roundRatios(experiment)
+        result.save(output("ratios.npz"))
+        result.to_csv(output("ratios.csv"))
+        for label in experiment.purpleAir:
+            if label not in [experiment.source, experiment.reference]:
+                curves[label] = ratios(label, experiment, output("ratios_" + label + ".png"))
+    return experiment.name, curves
+
+def run_batch(specs = None, workers = None):
+    """ Processes every experiment whose spec is in specs (by default each experiment.json
+    matching SPEC_PATTERN), one per worker process. Returns a dict mapping each experiment
+    name to its ratio curves """
+    specs = sorted(glob.glob(SPEC_PATTERN)) if specs is None else list(specs)
+    if not specs:
+        return {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or len(specs)) as executor:
+        results = dict(executor.map(process, specs))
+    print("processed %d experiments in %.1f s" % (len(specs), time.perf_counter() - start))
+    return results
+
+def benchmark_import(repeats=3):
+    """ Prints the time taken to import this module in a fresh interpreter, and the time
+    the PurpleAir sensors took to load when they were parsed at import """
+    script = "import time; start = time.perf_counter(); import exp; print(time.perf_counter() - start)"
+    here = os.path.dirname(os.path.abspath(__file__))
+    imports = [float(subprocess.run([sys.executable, "-c", script], cwd=here, capture_output=True,
+                                    text=True, check=True).stdout) for _ in range(repeats)]
+    print("import: %.3f s" % min(imports))
+    loads = []
+    for _ in range(repeats):
+        _loaded.clear()
+        start = time.perf_counter()
+        for filename in getExperiment().purpleAir.values():
+            purple_air_full(filename)
+            purple_air(filename)
+        loads.append(time.perf_counter() - start)
+    print("loading the PurpleAir sensors: %.3f s" % min(loads))
 
 def main():
-    fig1()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        run_batch(sys.argv[2:] or None)
+    else:
+        fig1()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
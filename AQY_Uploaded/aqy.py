@@ -1,96 +1,216 @@
 ###
-# Script for handling uploaded AQY data stored in multiple csvs
+# Script for handling uploaded AQY data stored in multiple csvs. Plots are decimated
+# (see common/decimate.py) so that months of 1 minute data render quickly
 ###
 
-import pandas as pd
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
 import numpy as np
 import os
+import sys
 from datetime import datetime
-from datetime import timedelta
-from pytz import timezone
-from scipy import interpolate
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import timeparse
+import csvcache
+import timegrid
+import decimate
+import store
+import tail
+import rolling
 
 # Set GLOBAL_START to be the time of the chronologically first data point
 GLOBAL_START = datetime.strptime("3/20/2020 10:04", "%m/%d/%Y %H:%M")
 
 PARAMS = {"pm":"PM2.5 (µg/m³)", "no2":"NO2 (ppb)", "o3":"O3 (ppb)"}
 
+# Quantities derived from PARAMS, as (expression, params) for derive
+DERIVED = {"ox": (lambda no2, o3: no2 + o3, ["no2", "o3"]),
+           "no2/o3": (lambda no2, o3: no2 / np.where(o3 != 0, o3, np.nan), ["no2", "o3"])}
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Furthest apart (in days) two samples can be and still be joined: half a minute
+JOIN_TOLERANCE = 30 / 86400
+
+# Centered window (in days) of the trend lines of the plots: an hour
+TREND_WINDOW = 1 / 24
+
 def time_minus_start(time):
     """ Returns the decimal number of days since the GLOBAL_START time """
     delta = time - GLOBAL_START
     secs = delta.total_seconds()
     return secs/86400 # days since global start time
 
-def get_data(param):
-    """ Fetches data from every csv in data directory (the names are irrelevant). Converts times 
-    to datetime objects, returning the parameter values and corresponding times sorted chronologically, 
-    where the times are the decimal number of days since the GLOBAL_START time """
-    files = os.listdir("data")
-    overall_pm = []
-    overall_times = []
-    for f in files:
-        try:
-            df = pd.read_csv("data/"+f, skiprows=6)
-            df = df[df[PARAMS[param]].notna()]
-        except: # some files have an abnormal layout
-            df = pd.read_csv("data/"+f, skiprows=0)
-            df = df[df[PARAMS[param]].notna()]
-        pm = df[PARAMS[param]].tolist()
-        table_times = df["Time"].tolist()
-        if len(table_times[0]) == 19:
-            times = [datetime.strptime(x, "%Y/%m/%d %H:%M:%S") for x in table_times]
-        else: # abnormal time representation
-            times = [datetime.strptime(x, "%m/%d/%Y %H:%M") for x in table_times]
-        days_since_start = [time_minus_start(x) for x in times]
-        overall_pm += pm
-        overall_times += days_since_start
-    overall_times, overall_pm = zip(*sorted(zip(overall_times, overall_pm)))
-    return overall_pm, overall_times
-
-def plot_pm():
-    """ Plots PM2.5 levels for the sensor by days since GLOBAL_START """
+def time_format(first):
+    """ Returns the strptime format of the AQY export times, given the first of them """
+    if len(first) == 19:
+        return "%Y/%m/%d %H:%M:%S"
+    return "%m/%d/%Y %H:%M" # abnormal time representation
+
+def sniff_layout(path):
+    """ Returns the number of lines before the header of the AQY export at path (the
+    website export has a 6 line preamble, the instrument export has none) and the
+    strptime format of its times """
+    with open(path, encoding="utf-8-sig") as f:
+        for skiprows, line in enumerate(f):
+            if line.startswith("Time,"):
+                break
+        else:
+            raise ValueError("no Time column in " + path)
+        for line in f:
+            first = line.split(",")[0]
+            if first:
+                break
+    return skiprows, time_format(first)
+
+def sensor_id(directory = "data"):
+    """ The sensor_id in the store of the AQY exports in directory """
+    return "AQY/" + os.path.basename(os.path.abspath(directory))
+
+def ingest_file(db, path):
+    """ Adds an AQY export to the store under the sensor_id of its directory """
+    skiprows, fmt = sniff_layout(path)
+    epoch, columns = store.read_csv(path, "Time", fmt, timeparse.LOCAL_TZ, skiprows)
+    db.insert(sensor_id(os.path.dirname(path)), store.MAIN_CHANNEL, epoch, columns)
+
+def ingest(db, directory = DATA_DIR):
+    """ Adds the AQY exports in the directory that are new or changed since the last
+    ingest to the store. Returns their paths """
+    paths = [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith(".csv")]
+    return store.ingest_files(db, paths, ingest_file)
+
+_loaded = {}
+
+def read_run(path, start):
+    """ The PARAMS columns of one csv through the csv cache, with "time" in days since
+    the start epoch seconds """
+    skiprows, fmt = sniff_layout(path)
+    cols = csvcache.read_columns(path, list(PARAMS.values()), "Time", fmt, timeparse.LOCAL_TZ, skiprows)
+    run = {param: cols[name].astype(float) for param, name in PARAMS.items()}
+    run["time"] = (cols["Time"] - start) / 86400 # days since global start time
+    return run
+
+# The run of each csv read through the csv cache, with the (mtime, size) it was read at
+_runs = {}
+
+def load_all(directory = "data"):
+    """ Reads the PARAMS columns of every csv in the directory (the names are irrelevant)
+    once, from the store if there is one and otherwise through the csv cache. Returns a
+    dict mapping "time" to the decimal number of days since GLOBAL_START and each PARAMS
+    key to its values (nan where missing), all in chronological order. The result is
+    kept until a file in the directory changes, and then only new or changed files are
+    parsed (and ingested) again """
+    start = timeparse.to_epoch([GLOBAL_START], tz=timeparse.LOCAL_TZ)[0]
+    db = store.default()
+    if db is not None:
+        key = ("store", sensor_id(directory))
+        if ingest(db, directory) or key not in _loaded:
+            cols = db.query(sensor_id(directory), store.MAIN_CHANNEL, list(PARAMS.values()))
+            data = {param: cols[name] for param, name in PARAMS.items()}
+            data["time"] = (cols["epoch"] - start) / 86400 # days since global start time
+            _loaded.clear()
+            _loaded[key] = data
+        return _loaded[key]
+    files = sorted(f for f in os.listdir(directory) if f.endswith(".csv"))
+    paths = [os.path.join(directory, f) for f in files]
+    key = (directory, tuple((p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths))
+    if key in _loaded:
+        return _loaded[key]
+    runs = []
+    for path, mtime, size in key[1]:
+        if _runs.get(path, (None,))[0] != (mtime, size):
+            _runs[path] = ((mtime, size), read_run(path, start))
+        runs.append(_runs[path][1])
+    # every file is already in time order, so the runs only need merging
+    runs.sort(key=lambda run: run["time"][0] if len(run["time"]) else np.inf)
+    data = {name: np.concatenate([run[name] for run in runs]) for name in ["time"] + list(PARAMS)}
+    if np.any(np.diff(data["time"]) < 0): # overlapping files
+        order = np.argsort(data["time"], kind="stable")
+        data = {name: vals[order] for name, vals in data.items()}
+    _loaded.clear()
+    _loaded[key] = data
+    return data
+
+def get_data(param, directory = "data"):
+    """ Fetches data from every csv in data directory (the names are irrelevant). Returns
+    the parameter values and corresponding times sorted chronologically, where the
+    times are the decimal number of days since the GLOBAL_START time """
+    data = load_all(directory)
+    present = ~np.isnan(data[param])
+    return data[param][present], data["time"][present]
+
+def join(params, tolerance = JOIN_TOLERANCE, directory = "data"):
+    """ Joins the series of the given PARAMS keys on time. The times of the first param
+    are kept and every other param takes its nearest sample within tolerance days (nan
+    if there is none). Returns the times and a list of value arrays in params order """
+    vals, times = get_data(params[0], directory)
+    joined = [vals]
+    for param in params[1:]:
+        other, otherTimes = get_data(param, directory)
+        joined.append(timegrid.resample(times, otherTimes, other, "nearest", tolerance))
+    return times, joined
+
+def derive(expression, params, tolerance = JOIN_TOLERANCE, directory = "data"):
+    """ Evaluates expression (a function taking one value array per param, e.g.
+    DERIVED["ox"]) on the time joined params. Returns the values and times, leaving out
+    times where any param is missing """
+    times, joined = join(params, tolerance, directory)
+    vals = np.asarray(expression(*joined), dtype=float)
+    present = ~np.isnan(vals)
+    return vals[present], times[present]
+
+def tail_export(path, params = ["pm"], skiprows = 0, capacity = tail.CAPACITY):
+    """ A tail.CsvTail following the PARAMS keys params of an AQY export as it is
+    written. skiprows is the length of its preamble (6 for the website export) """
+    parse_times = lambda df: timeparse.parse_epoch(df["Time"], time_format(df["Time"].iloc[0]), timeparse.LOCAL_TZ)[0]
+    return tail.CsvTail(path, [PARAMS[param] for param in params], parse_times, skiprows, capacity)
+
+def live(param = "pm", paths = [], skiprows = 0, interval = 1.0, duration = None):
+    """ Plots the PARAMS key param from each of the AQY exports live as they are written
+    (see tail.live_plot) """
+    return tail.live_plot([tail_export(path, [param], skiprows) for path in paths], interval, duration)
+
+def plot_trend(times, vals, stat):
+    """ Draws the rolling.trend stat of the values over TREND_WINDOW as a dashed line """
+    plt.plot(*decimate.decimate(times, rolling.trend(times, vals, TREND_WINDOW, stat)), "r--")
+
+def plot_pm(trend = None):
+    """ Plots PM2.5 levels for the sensor by days since GLOBAL_START, with the rolling
+    trend statistic (e.g. "median") if one is given """
     fig, ax = plt.subplots()
     pm, times = get_data("pm")
-    plt.scatter(times, pm, s=4)
+    plt.scatter(*decimate.decimate(times, pm), s=4)
+    if trend:
+        plot_trend(times, pm, trend)
     ax.set_ylim(-4, 35)
     plt.xlabel("Time [days]")
     plt.ylabel("Concentration [$\mu$g/m$^3$]")
     plt.title("AQY PM$_{2.5}$ Measurements March 20 - April 21")
     plt.show()
 
-def plot_no2_o3():
-    """ Plots NO2 and O3 levels for the sensor by days since GLOBAL_START """
-    no2, times = get_data("no2")
-    plt.scatter(times, no2, s=4)
-    o3, times = get_data("o3")
-    plt.scatter(times, o3, s=4)
+def plot_no2_o3(trend = None):
+    """ Plots NO2 and O3 levels for the sensor by days since GLOBAL_START, with the
+    rolling trend statistic of each if one is given """
+    no2, no2_times = get_data("no2")
+    plt.scatter(*decimate.decimate(no2_times, no2), s=4)
+    o3, o3_times = get_data("o3")
+    plt.scatter(*decimate.decimate(o3_times, o3), s=4)
+    if trend:
+        plot_trend(no2_times, no2, trend)
+        plot_trend(o3_times, o3, trend)
     plt.legend(["NO$_2$", "O$_3$"])
     plt.xlabel("Time [days]")
     plt.ylabel("Concentration [ppb]")
     plt.title("AQY NO$_2$ and O$_3$ Measurements March 20 - April 21")
     plt.show()
 
-def plot_no2_plus_o3():
-    """ Plots NO2 and O3 levels added together for the sensor by days since GLOBAL_START """
-    no2, times1 = get_data("no2")
-    o3, times2 = get_data("o3")
-    i = 0
-    j = 0
-    sums = []
-    sums_times = []
-    while i < len(times1) and j < len(times2):
-        if times1[i] == times2[j]:
-            sums.append(no2[i] + o3[j])
-            sums_times.append(times1[i])
-            i += 1
-            j += 1
-        elif times1[i] < times2[j]:
-            i += 1
-        else:
-            j += 1
-    plt.scatter(sums_times, sums, s=4)
+def plot_no2_plus_o3(trend = None):
+    """ Plots NO2 and O3 levels added together for the sensor by days since GLOBAL_START,
+    with the rolling trend statistic if one is given """
+    sums, sums_times = derive(*DERIVED["ox"])
+    plt.scatter(*decimate.decimate(sums_times, sums), s=4)
+    if trend:
+        plot_trend(sums_times, sums, trend)
     plt.xlabel("Time [days]")
     plt.ylabel("Concentration [ppb]")
     plt.title("AQY NO$_2$+O$_3$ Total March 20 - April 21")
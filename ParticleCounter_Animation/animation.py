@@ -1,29 +1,138 @@
 ###
-# Script for plotting and animating data from Prof. Hawkins's particle counter
+# Script for plotting and animating data from Prof. Hawkins's particle counter. The counter
+# logs once a second, so the log is searched by bisection for the requested time range
+# and only that part is parsed
 ###
 
+import io
+import mmap
+import os
+import sys
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import frames
+import timeparse
+import timegrid
+import store
+import tail
+import rolling
+
+COUNTER_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "counter_data.csv")
+DATE_COLUMN = "#YY/MM/DD"
+CLOCK_COLUMN = "HR:MN:SC"
+CHUNK_ROWS = 100000 # rows of the counter log parsed at a time
+COUNTER_SENSOR = "counter" # sensor_id of the counter in the store
+
+# Centered window (in seconds) of the trend line of plot
+TREND_WINDOW = 60
 
 START_TIME = "15:18:13"
 END_TIME = "15:36:55"
 
+def fixed_digits(column, width):
+    """ Returns the characters of a column of fixed width strings as a (rows x width) int
+    array of digit values (separators give meaningless values) """
+    return np.asarray(column, dtype="S%d" % width).view(np.uint8).reshape(-1, width).astype(np.int64) - ord("0")
+
+def counter_epoch(dates, clocks):
+    """ Converts the YY/MM/DD and HR:MN:SC columns of the counter log (local time) to
+    epoch seconds (timeparse.NAT where a time cannot be parsed). The digits are read
+    straight from the fixed width fields, falling back to parsing the strings if any
+    field is malformed """
+    dates = pd.Series(dates, dtype=str)
+    clocks = pd.Series(clocks, dtype=str)
+    if not (dates.str.len().eq(8).all() and clocks.str.len().eq(8).all()):
+        iso = "20" + dates.str.replace("/", "-") + "T" + clocks
+        return timeparse.parse_epoch(iso, "ISO8601", timeparse.LOCAL_TZ)[0]
+    d = fixed_digits(dates, 8)
+    c = fixed_digits(clocks, 8)
+    months = (d[:, 0]*10 + d[:, 1] + 30) * 12 + d[:, 3]*10 + d[:, 4] - 1 # months since 1970
+    days = months.astype("datetime64[M]").astype("datetime64[D]") + (d[:, 6]*10 + d[:, 7] - 1)
+    seconds = (c[:, 0]*10 + c[:, 1]) * 3600 + (c[:, 3]*10 + c[:, 4]) * 60 + c[:, 6]*10 + c[:, 7]
+    return timeparse.parse_epoch(days.astype("datetime64[s]") + seconds, tz=timeparse.LOCAL_TZ)[0]
+
+def line_key(mm, pos):
+    """ Returns the date and clock bytes of the log line starting at pos, which sort in
+    time order as both are zero padded """
+    return mm[pos:pos+8] + mm[pos+9:pos+17]
+
+def bisect_lines(mm, key, lo, hi, after = False):
+    """ Returns the offset of the first line in mm[lo:hi] (lo at a line start) whose key is
+    at least key (greater than key if after), or hi if there is none """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        line = mm.rfind(b"\n", 0, mid) + 1
+        if line < lo: # mid is in the first line of the range
+            line = lo
+        below = line_key(mm, line) <= key if after else line_key(mm, line) < key
+        if below:
+            lo = mm.find(b"\n", line) + 1 or hi
+        else:
+            hi = line
+    return lo
+
+def read_counter(params, start = None, end = None, path = COUNTER_FILE, chunksize = CHUNK_ROWS):
+    """ Returns a dict mapping each of params and CLOCK_COLUMN to an array, plus "time"
+    in epoch seconds. start and end are HR:MN:SC times on the first day of the log, and
+    only the samples from the one nearest start to the one nearest end are returned.
+    Lines whose time cannot be parsed are left out. The log is memory mapped and the
+    lines around start and end found by bisection, so only that part of a long log is
+    read, chunksize rows at a time """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        body = mm.find(b"\n") + 1
+        header = mm[:body].decode("utf-8-sig").strip().split(",")
+        lo, hi = body, len(mm)
+        day = mm[body:body+8]
+        if start is not None:
+            first = bisect_lines(mm, day + start.encode(), body, len(mm))
+            lo = mm.rfind(b"\n", 0, first-1) + 1 if first > body else body # keep the line before
+        if end is not None:
+            last = bisect_lines(mm, day + end.encode(), lo, len(mm), after=True)
+            if last < len(mm): # keep the line after
+                hi = mm.find(b"\n", last) + 1 or len(mm)
+        text = io.BytesIO(mm[lo:hi])
+    columns = [DATE_COLUMN, CLOCK_COLUMN] + list(params)
+    pieces = []
+    for chunk in pd.read_csv(text, names=header, header=None, usecols=columns, chunksize=chunksize):
+        piece = {name: chunk[name].to_numpy() for name in columns[1:]}
+        piece["time"] = counter_epoch(chunk[DATE_COLUMN], chunk[CLOCK_COLUMN])
+        valid = piece["time"] != timeparse.NAT
+        pieces.append({name: vals[valid] for name, vals in piece.items()})
+    data = {name: np.concatenate([piece[name] for piece in pieces]) for name in pieces[0]}
+    bounds = [counter_epoch([day.decode()], [clock])[0] if clock is not None else limit
+              for clock, limit in [(start, data["time"][0]), (end, data["time"][-1])]]
+    pos = timegrid.nearest_slice(data["time"], *bounds)
+    return {name: vals[pos] for name, vals in data.items()}
+
+def ingest_log(db, path):
+    """ Adds every column of a counter log to the store as COUNTER_SENSOR """
+    with open(path, encoding="utf-8-sig") as f:
+        params = [name for name in f.readline().strip().split(",") if name not in (DATE_COLUMN, CLOCK_COLUMN)]
+    data = read_counter(params, path=path)
+    db.insert(COUNTER_SENSOR, store.MAIN_CHANNEL, data["time"], {name: data[name].astype(float) for name in params})
+
+def ingest(db, path = COUNTER_FILE):
+    """ Adds the counter log to the store if it is new or changed since the last ingest.
+    Returns the paths ingested """
+    return store.ingest_files(db, [path], ingest_log)
+
+def tail_counter(path = COUNTER_FILE, params = ["concent"], capacity = tail.CAPACITY):
+    """ A tail.CsvTail following the params of a counter log as it is written """
+    return tail.CsvTail(path, params, lambda df: counter_epoch(df[DATE_COLUMN], df[CLOCK_COLUMN]), capacity=capacity)
+
+def live(param = "concent", paths = [COUNTER_FILE], interval = 1.0, duration = None):
+    """ Plots param from each of the counter logs live as they are written (see
+    tail.live_plot) """
+    return tail.live_plot([tail_counter(path, [param]) for path in paths], interval, duration)
+
 def extract(param):
-    df = pd.read_csv("counter_data.csv")
-    vals = list(df[param].values)
-    times = list(df["HR:MN:SC"].values)
-    for i in range(len(times)):
-        if times[i] == START_TIME:
-            vals = vals[i:]
-            times = times[i:]
-            break
-    for i in range(len(times)):
-        if times[i] == END_TIME:
-            vals = vals[:i+1]
-            times = times[:i+1]
-            break
-    return vals, times
+    """ Returns the values of param and their HR:MN:SC times from the sample nearest
+    START_TIME to the one nearest END_TIME """
+    data = read_counter([param], START_TIME, END_TIME)
+    return data[param], data[CLOCK_COLUMN]
 
 def getTicksAndTimes(rawTimes, interval = 180):
     ticks = list(range(0, len(rawTimes), 180))
@@ -32,9 +141,11 @@ def getTicksAndTimes(rawTimes, interval = 180):
         times.append(rawTimes[i])
     return ticks, times
 
-def plot(param):
-    """ Plots the data for the specified parameter """
-    vals, rawTimes = extract(param)
+def plot(param, trend = None):
+    """ Plots the data for the specified parameter, with its rolling trend statistic
+    (e.g. "median") over TREND_WINDOW if one is given """
+    data = read_counter([param], START_TIME, END_TIME)
+    vals, rawTimes = data[param], data[CLOCK_COLUMN]
     locs = list(range(len(vals)))
     ticks, times = getTicksAndTimes(rawTimes, 180)
     plt.xticks(ticks, times)
@@ -44,14 +155,14 @@ def plot(param):
     plt.title("PM$_{0.007}$ - PM$_{2.0}$ Concentration")
 
     plt.plot(locs, vals)
+    if trend:
+        plt.plot(locs, rolling.trend(data["time"], vals, TREND_WINDOW, trend), "r--")
     plt.show()
 
-def animate(param):
-    """ Generates an animation of the specified parameter over time """
-    plt.rcParams['animation.ffmpeg_path'] = 'C:\\ffmpeg\\bin\\ffmpeg.exe'
-
+def animate(param, ffmpeg=None, workers=1):
+    """ Generates an animation of the specified parameter over time. The frames are
+    rendered off screen and encoded with ffmpeg (see frames.render) """
     fig, ax = plt.subplots()
-    xdata, ydata = [], []
     ln, = plt.plot([], [], color=(0, 0, 0))
 
     size = 15
@@ -64,24 +175,11 @@ def animate(param):
     vals, rawTimes = extract(param)
     locs = list(range(len(vals)))
 
-    def init():
-        ax.set_xlim(-20, len(vals)+175)
-        ax.set_ylim(9000, 14000)
-        return ln,
-
-    def frame(i):
-        xdata.append(locs[i])
-        ydata.append(vals[i])
-        ln.set_data(xdata, ydata)
-        return ln,
-    
-    anim = animation.FuncAnimation(fig, frame, init_func=init,
-                                frames=len(vals), interval=20, blit=True)
-    
-    FFMpegWriter = animation.writers['ffmpeg']
-    writer = FFMpegWriter(fps=51, metadata=dict(artist='Me'), bitrate=1800)
-    
-    anim.save('basic_animation.mp4', writer=writer)
+    ax.set_xlim(-20, len(vals)+175)
+    ax.set_ylim(9000, 14000)
+
+    frames.render(fig, [ln], [(locs, vals)], 'basic_animation.mp4', 51, ffmpeg, workers=workers)
+    plt.close(fig)
 
 if __name__ == "__main__":
     plot("concent")
\ No newline at end of file
@@ -2,86 +2,203 @@
 # Helper functions for handling background sensor data. Used in purple_data.py
 ###
 
-import pandas as pd
-import matplotlib.pyplot as plt
+import os
+import sys
+import time
 import statistics
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import timeparse
+import timegrid
+import channels
+import csvcache
+import sensorseries
+import store
 
 def organizeDays(vals, times):
-    dayDict = {}
-    for i in range(len(times)):
-        time = times[i]
-        time = time.split()
-        day = int(time[0][-2:])
-        hour = int(time[1][:2])
-        minute = int(time[1][3:5])
-        pstHour = hour - 7
-        if pstHour < 0:
-            day -= 1
-            pstHour += 24
-        pstTime = pstHour + minute / 60
-        if day not in dayDict:
-            dayDict[day] = [[pstTime], [vals[i]]]
-        else:
-            dayDict[day][0].append(pstTime)
-            dayDict[day][1].append(vals[i])
-    return dayDict
-
-def sensor_signal(name, param, days, disjoint = True):
-    df_A = pd.read_csv("pilot_background/"+name+"_A_Primary.csv")
-    df_B = pd.read_csv("pilot_background/"+name+"_B_Primary.csv")
-    if param not in df_A.columns:
-        df_A = pd.read_csv("pilot_background/"+name+"_A_Secondary.csv")
-        df_B = pd.read_csv("pilot_background/"+name+"_B_Secondary.csv")
-    
-    times = df_A["created_at"].tolist()
-    vals = df_A[param].tolist()
-    vals_B = df_B[param].tolist()
-    for i in range(len(vals_B)):
-        try:
-            vals[i] = (vals[i] + vals_B[i]) / 2
-        except IndexError:
-            pass
-    
-    dayDict = organizeDays(vals, times)
+    """ Buckets the values by Pacific day of the month. Returns a dict mapping the day
+    to its SensorSeries """
+    epoch, valid = timeparse.parse_epoch(times, timeparse.WEBSITE_FORMAT)
+    return sensorseries.SensorSeries(epoch, vals)[valid].days()
+
+BACKGROUND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pilot_background")
+
+def ingest_file(db, path):
+    """ Adds a website download (<name>_<channel>_<table>.csv) to the store, with the
+    sensor name as sensor_id and its "A" or "B" channel. The Primary and Secondary tables
+    of a channel fill different parameter columns """
+    name, channel, table = os.path.basename(path)[:-4].rsplit("_", 2)
+    epoch, columns = store.read_csv(path, "created_at", timeparse.WEBSITE_FORMAT, exclude=["entry_id"])
+    db.insert(name, channel, epoch, columns)
+
+def ingest(db, names = None):
+    """ Adds the downloads of the named background sensors (all by default) that are new
+    or changed since the last ingest to the store. Returns their paths """
+    files = sorted(f for f in os.listdir(BACKGROUND_DIR) if f.endswith(".csv"))
+    if names is not None:
+        files = [f for f in files if f.rsplit("_", 2)[0] in names]
+    return store.ingest_files(db, [os.path.join(BACKGROUND_DIR, f) for f in files], ingest_file)
+
+def sensor_file(name, channel, table):
+    """ Returns the path of the website download for the sensor's channel ("A" or "B")
+    and table ("Primary" or "Secondary") """
+    return "pilot_background/"+name+"_"+channel+"_"+table+".csv"
+
+def sensor_channels(name, param, qc = False):
+    """ Returns the epoch seconds, the fused A/B channel values (see
+    channels.fuse_channels) and the rejected sample flags for the sensor's param. With
+    qc the rejected samples are nan. Reads the store if there is one """
+    db = store.default()
+    if db is not None:
+        ingest(db, [name])
+        a = db.query(name, "A", [param])
+        b = db.query(name, "B", [param])
+        vals, rejected = channels.fuse_channels(a[param], b[param], a["epoch"], b["epoch"], drop=qc)
+        return a["epoch"], vals, rejected
+    table = "Primary"
+    if param not in csvcache.columns(sensor_file(name, "A", table)):
+        table = "Secondary"
+    df_A = csvcache.read_columns(sensor_file(name, "A", table), [param], "created_at", timeparse.WEBSITE_FORMAT)
+    df_B = csvcache.read_columns(sensor_file(name, "B", table), [param], "created_at", timeparse.WEBSITE_FORMAT)
+    times = df_A["created_at"]
+    vals, rejected = channels.fuse_channels(df_A[param], df_B[param], times, df_B["created_at"], drop=qc)
+    return times, vals, rejected
+
+def sensor_series(name, param, qc = False):
+    """ The fused A/B channel values of the sensor's param (see sensor_channels) as a
+    SensorSeries """
+    times, vals, rejected = sensor_channels(name, param, qc)
+    return sensorseries.SensorSeries(times, vals, name, "A+B")
+
+def rejected_per_day(name, param, days = None):
+    """ The number of the sensor's samples of param on each day whose A and B channels
+    disagree (see channels.disagreement), for the given days or every day """
+    times, vals, rejected = sensor_channels(name, param)
+    counts = channels.count_by_day(times, rejected)
+    if days is None:
+        return counts
+    return {day: counts.get(day, 0) for day in days}
+
+def sensor_signal(name, param, days, disjoint = True, qc = False):
+    """ Returns the sensor's SensorSeries on each of the days, or if not disjoint one
+    series joining them """
+    dayDict = sensor_series(name, param, qc).days()
     if disjoint:
-        output = []
-        for day in days:
-            output.append([dayDict[day][0], dayDict[day][1]])
+        return [dayDict[day] for day in days]
+    return sensorseries.SensorSeries.concatenate([dayDict[day] for day in days])
+
+def get_signals(names, param, days, workers = 1, pool = "thread", qc = False):
+    """ Returns the joined signal (see sensor_signal) of each named sensor. With workers
+    greater than 1 the sensors are loaded concurrently by at most that many workers in a
+    "thread" or "process" pool. The output is always in the order of names """
+    if workers <= 1 or len(names) <= 1:
+        return [sensor_signal(name, param, days, False, qc) for name in names]
+    if pool == "thread":
+        executor = ThreadPoolExecutor(max_workers=min(workers, len(names)))
+    elif pool == "process":
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(names)))
     else:
-        output = [[], []]
-        for day in days:
-            output[0].extend(dayDict[day][0])
-            output[1].extend(dayDict[day][1])
-    return output
+        raise ValueError("pool must be thread or process, not " + str(pool))
+    with executor:
+        return list(executor.map(sensor_signal, names, repeat(param), repeat(days), repeat(False), repeat(qc)))
 
-def get_signals(names, param, days):
-    output = []
-    for name in names:
-        output.append(sensor_signal(name, param, days, False))
-    return output
+def align_signals(signals, grid = None, method = "nearest", tolerance = timegrid.TOLERANCE):
+    """ Resamples each SensorSeries onto the grid of epoch seconds (by default a regular
+    grid over the period every signal covers) with timegrid.resample. Returns series all
+    sharing the grid times, with nan where a sensor has no sample within tolerance """
+    if grid is None:
+        grid = timegrid.common_grid([x.epoch for x in signals])
+    grid = np.asarray(grid, dtype=np.int64)
+    return [signal.resample(grid, method, tolerance) for signal in signals]
+
+def stack_signals(signals):
+    """ Stacks the equal length value signals (arrays or SensorSeries) into a
+    (sensors x time) float array """
+    if not isinstance(signals, np.ndarray):
+        signals = [x.values if isinstance(x, sensorseries.SensorSeries) else x for x in signals]
+    return np.asarray(signals, dtype=float).reshape(len(signals), -1)
 
-def align_signals(signals):
-    lens = [len(x[1]) for x in signals]
-    min_length = min(lens)
-    output = []
-    for signal in signals:
-        output.append([signal[0][:min_length], signal[1][:min_length]])
+def reduce_signals(signals, combine = "median", proportion = 0.1, q = 50, min_count = 1):
+    """ Combines the aligned value signals time point by time point, ignoring nan.
+    combine is "average", "median", "trimmed" (mean after dropping the proportion of
+    lowest and highest values) or "percentile" (the qth percentile). Time points where
+    fewer than min_count sensors have a value are nan. Returns a numpy array, or for
+    aligned SensorSeries a series on their shared times """
+    if len(signals) and isinstance(signals[0], sensorseries.SensorSeries):
+        output = reduce_signals([x.values for x in signals], combine, proportion, q, min_count)
+        return sensorseries.SensorSeries(signals[0].epoch, output, combine, signals[0].channel)
+    stack = stack_signals(signals)
+    counts = np.sum(~np.isnan(stack), axis=0)
+    output = np.full(stack.shape[1], np.nan)
+    enough = counts >= max(min_count, 1)
+    if not enough.all():
+        stack = stack[:, enough]
+        counts = counts[enough]
+    if combine == "average":
+        output[enough] = np.nansum(stack, axis=0) / counts
+        return output
+    ordered = np.sort(stack, axis=0) # nan sorts last, so each column's values come first
+    if combine in ("median", "percentile"):
+        # linear interpolation between the closest ranks, as in np.percentile
+        position = (counts - 1) * ((50 if combine == "median" else q) / 100)
+        low = np.floor(position).astype(int)
+        high = np.ceil(position).astype(int)
+        lowVals = np.take_along_axis(ordered, low[None, :], axis=0)[0]
+        highVals = np.take_along_axis(ordered, high[None, :], axis=0)[0]
+        output[enough] = lowVals + (position - low) * (highVals - lowVals)
+    elif combine == "trimmed":
+        cut = np.floor(counts * proportion).astype(int)
+        ranks = np.arange(len(ordered))[:, None]
+        keep = (ranks >= cut) & (ranks < counts - cut)
+        output[enough] = np.where(keep, ordered, 0).sum(axis=0) / keep.sum(axis=0)
+    else:
+        raise ValueError("unknown combine option " + str(combine))
     return output
 
 def average_signals(signals):
-    avg_signal = signals[0]
-    for signal in signals[1:]:
-        avg_signal = [x+y for x, y in zip(avg_signal, signal)]
-    avg_signal = [x/len(signals) for x in avg_signal]
-    return avg_signal
+    return reduce_signals(signals, "average")
 
 def median_signals(signals):
-    med_signal = []
-    for i in range(len(signals[0])):
-        vals = [x[i] for x in signals]
-        med_signal.append(statistics.median(vals))
-    return med_signal
+    return reduce_signals(signals, "median")
+
+def trimmed_mean_signals(signals, proportion = 0.1):
+    return reduce_signals(signals, "trimmed", proportion=proportion)
+
+def percentile_signals(signals, q):
+    return reduce_signals(signals, "percentile", q=q)
+
+def benchmark_reductions(num_sensors = 200, length = 21600, repeats = 3):
+    """ Times the average and median of num_sensors random signals (21600 samples is a
+    month at 2 minute resolution) against the list based implementations these replaced """
+    def list_average(signals):
+        avg_signal = signals[0]
+        for signal in signals[1:]:
+            avg_signal = [x+y for x, y in zip(avg_signal, signal)]
+        return [x/len(signals) for x in avg_signal]
+
+    def list_median(signals):
+        return [statistics.median([x[i] for x in signals]) for i in range(len(signals[0]))]
+
+    rng = np.random.default_rng(0)
+    stack = rng.gamma(2, 5, (num_sensors, length))
+    lists = stack.tolist()
+    for name, old, new in [("average", list_average, average_signals), ("median", list_median, median_signals)]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            expected = old(lists)
+        oldTime = (time.perf_counter() - start) / repeats
+        start = time.perf_counter()
+        for _ in range(repeats):
+            result = new(stack)
+        newTime = (time.perf_counter() - start) / repeats
+        assert np.allclose(result, expected)
+        print(name+": lists %.3f s, array %.4f s (%.0fx)" % (oldTime, newTime, oldTime / newTime))
 
 def subtract_signals(first, second):
-    """ first - second """
-    return [x-y for x, y in zip(first, second)]
\ No newline at end of file
+    """ first - second. SensorSeries are lined up by time (see SensorSeries.aligned) """
+    if isinstance(first, sensorseries.SensorSeries):
+        return first - second
+    return np.asarray(first, dtype=float) - np.asarray(second, dtype=float)
\ No newline at end of file
@@ -6,153 +6,306 @@
 # the PurpleAir website
 ###
 
+import os
+import sys
+import time
+import datetime
 import pandas as pd
 import matplotlib.pyplot as plt
-import statistics
 import background_sensors
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import timeparse
+import csvcache
+import channels
+import diurnal
+import decimate
+import sensorseries
+import store
+import tail
+import rolling
+
 BACKGROUND_SENSOR_NAMES = ["01", "AQMD", "AQMD48", "Bike", "NW", "Piedmond"]
+# Number of background sensors loaded at once (see background_sensors.get_signals). The
+# six sensors above load fastest serially; raise this for a large sensor network
+BACKGROUND_WORKERS = 1
+
+# Trend line of allData: the rolling.trend statistic over a centered window of seconds
+TREND_STAT = "median"
+TREND_WINDOW = 3 * 3600
 
-def relativeHours(times, minDay):
-    hours = []
-    for time in times:
-        try:
-            tIndex = time.find("T")
-            day = int(time[tIndex-2:tIndex])
-            hour = int(time[tIndex+1:tIndex+3])
-            minute = int(time[tIndex+4:tIndex+6])
-            utcHour = (day-minDay)*24 + hour + minute / 60
-            pstHour = utcHour + 17
-            pstHour = pstHour % 24
-            hours.append(pstHour)
-        except AttributeError:
-            hours.append(hours[-1])
-    return hours
+def relativeHours(times, minDay = None):
+    """ Returns the fractional Pacific hour of the day for each UTCDateTime string, nan
+    for missing times. minDay is kept for older callers """
+    epoch, valid = timeparse.parse_epoch(times, timeparse.SD_CARD_FORMAT)
+    hours = np.full(len(epoch), np.nan)
+    hours[valid] = timeparse.relative_hours(epoch[valid])
+    return list(hours)
 
 def organizeDays(vals, times):
+    """ Buckets the values by Pacific day of the month, leaving out samples with no valid
+    time. Returns a dict mapping the day to its SensorSeries """
+    epoch, valid = timeparse.parse_epoch(times, timeparse.SD_CARD_FORMAT)
+    return sensorseries.SensorSeries(epoch, vals)[valid].days()
+
+CHUNK_ROWS = 50000
+
+PILOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pilot")
+PILOT_SENSOR = "pilot" # sensor_id of the pilot sensor in the store
+
+def pilotFile(day):
+    return "pilot/201910"+str(day)+".csv"
+
+def pilotDates(days):
+    """ The datetime.date of each pilot day, given as a day of the month of the pilot
+    files or already as a date """
+    return [day if isinstance(day, datetime.date) else datetime.date(2019, 10, day) for day in days]
+
+def pilotStart(day):
+    """ The epoch seconds of UTC midnight on the day, where the pilot log of that day begins """
+    return timeparse.to_epoch(["2019/10/%02dT00:00:00z" % day], timeparse.SD_CARD_FORMAT)[0]
+
+def ingestLog(db, path):
+    """ Adds a pilot SD card log to the store as the "A" and "B" channels of PILOT_SENSOR """
+    epoch, columns = store.read_csv(path, "UTCDateTime", timeparse.SD_CARD_FORMAT)
+    a, b = channels.split_columns(columns)
+    db.insert(PILOT_SENSOR, "A", epoch, a)
+    db.insert(PILOT_SENSOR, "B", epoch, b)
+
+def ingest(db):
+    """ Adds the pilot logs that are new or changed since the last ingest to the store.
+    Returns their paths """
+    paths = [os.path.join(PILOT_DIR, f) for f in sorted(os.listdir(PILOT_DIR)) if f.endswith(".csv")]
+    return store.ingest_files(db, paths, ingestLog)
+
+def tailLog(path, params = ["pm2_5_atm"], capacity = tail.CAPACITY):
+    """ A tail.CsvTail following the params of a pilot SD card log as it is written """
+    return tail.CsvTail(path, params, lambda df: timeparse.parse_epoch(df["UTCDateTime"], timeparse.SD_CARD_FORMAT)[0],
+                        capacity=capacity)
+
+def livePilot(paths, param = "pm2_5_atm", interval = 1.0, duration = None):
+    """ Plots param from each of the SD card logs live as they are written (see
+    tail.live_plot) """
+    return tail.live_plot([tailLog(path, [param]) for path in paths], interval, duration)
+
+def streamDays(param, paths, option = "NA", chunksize = CHUNK_ROWS):
+    """ Reads the pilot csvs in paths (daily files or one long SD card log, in
+    chronological order) chunksize rows at a time, parsing only the time and param
+    columns, and yields (local date, epoch seconds, fractional hours, values) arrays for
+    each local day. Rows with no valid time are skipped. Only the day being read and one
+    chunk are held in memory """
+    columns = ["UTCDateTime"] + pilotColumns(param, option)
+    pendingTimes = np.empty(0, dtype=np.int64)
+    pendingVals = np.empty(0)
+    for path in paths:
+        for chunk in csvcache.read_csv(path, columns, chunksize=chunksize):
+            times, valid = timeparse.parse_epoch(chunk["UTCDateTime"], timeparse.SD_CARD_FORMAT)
+            chunk = chunk[valid] # also drops headers repeated in joined logs
+            times = times[valid]
+            if len(chunk) == 0:
+                continue
+            a = pd.to_numeric(chunk[param], errors="coerce").to_numpy(dtype=float)
+            if option in ("average", "qc"):
+                b = pd.to_numeric(chunk[param+"_b"], errors="coerce").to_numpy(dtype=float)
+                vals = channels.fuse_channels(a, b, drop=(option == "qc"))[0]
+            else:
+                vals = a
+            times = np.concatenate([pendingTimes, times])
+            vals = np.concatenate([pendingVals, vals])
+            dates = timeparse.local_dates(times)
+            done = dates < dates[-1] # the last day may continue in the next chunk
+            for item in _dayArrays(times[done], vals[done]):
+                yield item
+            pendingTimes = times[~done]
+            pendingVals = vals[~done]
+    for item in _dayArrays(pendingTimes, pendingVals):
+        yield item
+
+def streamDayDict(param, paths, option = "NA", dates = None):
+    """ Maps each local date (datetime.date) in the pilot logs in paths, or each of dates
+    that the logs cover, to the pilot SensorSeries of param on it. The logs are read with
+    streamDays, so only param's values are kept rather than every column of the logs """
+    wanted = None if dates is None else set(dates)
     dayDict = {}
-    for i in range(len(times)):
-        time = times[i]
-        tIndex = time.find("T")
-        day = int(time[tIndex-2:tIndex])
-        hour = int(time[tIndex+1:tIndex+3])
-        minute = int(time[tIndex+4:tIndex+6])
-        pstHour = hour - 7
-        if pstHour < 0:
-            day -= 1
-            pstHour += 24
-        pstTime = pstHour + minute / 60
-        if day not in dayDict:
-            dayDict[day] = [[pstTime], [vals[i]]]
-        else:
-            dayDict[day][0].append(pstTime)
-            dayDict[day][1].append(vals[i])
+    for date, times, hours, vals in streamDays(param, paths, option):
+        if wanted is None or date in wanted:
+            dayDict[date] = sensorseries.SensorSeries(times, vals, "pilot", option)
     return dayDict
 
-def overlayData(param, days, option = "NA", interval = 2):
-    vals = []
-    times = []
-    for i in range(days[0], days[-1]+2):
-        df = pd.read_csv("pilot/201910"+str(i)+".csv")
-        a_channel = list(df[param].values)
-        if option == "average":
-            b_channel = list(df[param+"_b"].values)
-            avg = []
-            for i in range(len(a_channel)):
-                avg.append((a_channel[i] + b_channel[i]) / 2)
-            vals.extend(avg)
+def _dayArrays(times, vals):
+    """ Splits chronological epoch seconds and values into (local date, epoch seconds,
+    fractional hours, values) per local day """
+    dates = timeparse.local_dates(times)
+    hours = timeparse.relative_hours(times)
+    for date, pos in timeparse.split_days(dates).items():
+        yield date, times[pos], hours[pos], vals[pos]
+
+class PilotDataset:
+    """ The pilot sensor columns for a range of days, read once (from the store if it has
+    been ingested, otherwise through the csv cache) and held in memory as numpy arrays so
+    that every figure and aggregation on those days can be served without going back to
+    the files. Background sensor signals are also kept once they have been fetched """
+
+    def __init__(self, days, columns):
+        self.days = list(days)
+        self.columns = list(columns)
+        db = store.default()
+        if db is not None:
+            ingest(db) # only the logs that arrived since the last run are parsed
+            self.times, self.values = self.query(db)
         else:
-            vals.extend(a_channel)
-        times.extend(list(df["UTCDateTime"].values))
-    
-    dayDict = organizeDays(vals, times)
+            times = []
+            values = {column: [] for column in self.columns}
+            for i in range(self.days[0], self.days[-1]+2):
+                cols = csvcache.read_columns(pilotFile(i), self.columns, "UTCDateTime", timeparse.SD_CARD_FORMAT)
+                times.append(cols["UTCDateTime"])
+                for column in self.columns:
+                    values[column].append(cols[column])
+            self.times = np.concatenate(times)
+            self.values = {column: np.concatenate(values[column]) for column in self.columns}
+        self.dayDicts = {}
+        self.backgrounds = {}
+        self.dailyProfiles = {}
+
+    def query(self, db):
+        """ Reads the columns from the store over the span of the daily files, the "_b"
+        columns coming from the B channel. Returns the times and a dict of the columns """
+        start, end = pilotStart(self.days[0]), pilotStart(self.days[-1]+2) - 1
+        channelA = [column for column in self.columns if not column.endswith("_b")]
+        channelB = [column[:-2] for column in self.columns if column.endswith("_b")]
+        a = db.query(PILOT_SENSOR, "A", channelA, start, end, dropna=False)
+        b = db.query(PILOT_SENSOR, "B", channelB, start, end, dropna=False)
+        values = {column: a[column] if column in channelA else b[column[:-2]] for column in self.columns}
+        return a["epoch"], values
+
+    def signal(self, param, option = "NA"):
+        """ The values of param, averaged with its b channel if option is "average", and
+        with samples where the channels disagree (see channels.fuse_channels) set to nan
+        if option is "qc" """
+        if option in ("average", "qc"):
+            return channels.fuse_channels(self.values[param], self.values[param+"_b"], drop=(option == "qc"))[0]
+        return self.values[param]
+
+    def profiles(self, param, option = "NA"):
+        """ DailyProfiles of param for every day in the dataset """
+        if (param, option) not in self.dailyProfiles:
+            self.dailyProfiles[(param, option)] = pilotProfiles(param, self.days, option, self)
+        return self.dailyProfiles[(param, option)]
+
+    def rejectedPerDay(self, param):
+        """ The number of samples on each day whose a and b channels disagree """
+        rejected = channels.disagreement(self.values[param], self.values[param+"_b"])
+        return channels.count_by_day(self.times, rejected)
+
+    def dayDict(self, param, option = "NA"):
+        """ organizeDays style output for param: the pilot SensorSeries on each day """
+        if (param, option) not in self.dayDicts:
+            signal = sensorseries.SensorSeries(self.times, self.signal(param, option), "pilot", option)
+            self.dayDicts[(param, option)] = signal.days()
+        return self.dayDicts[(param, option)]
+
+    def series(self, param, option, days):
+        """ The pilot SensorSeries of param over the given days """
+        dayDict = self.dayDict(param, option)
+        return sensorseries.SensorSeries.concatenate([dayDict[day] for day in days])
+
+    def backgroundSignals(self, names, param, days):
+        """ background_sensors.get_signals output for the named sensors """
+        key = (tuple(names), param, tuple(days))
+        if key not in self.backgrounds:
+            self.backgrounds[key] = background_sensors.get_signals(names, param, days, BACKGROUND_WORKERS)
+        return self.backgrounds[key]
+
+def pilotColumns(param, option = "NA"):
+    """ The pilot csv columns needed for param with the given channel option """
+    return [param, param+"_b"] if option in ("average", "qc") else [param]
+
+def pilotDays(param, days, option = "NA", data = None, paths = None):
+    """ Returns organizeDays style output for param on the given days, averaging the a
+    and b channels if option is "average" (or "qc", which also drops samples where the
+    channels disagree). Reads the files unless a PilotDataset covering the days is given.
+    With paths, the SD card logs there (e.g. a year of them) are streamed instead (see
+    streamDayDict), the output is keyed by local date and days are dates (None for all) """
+    if paths is not None:
+        return streamDayDict(param, paths, option, days)
+    if data is None:
+        data = PilotDataset(days, pilotColumns(param, option))
+    return data.dayDict(param, option)
+
+def overlayData(param, days, option = "NA", interval = 2, data = None, paths = None):
+    dayDict = pilotDays(param, days, option, data, paths)
+    days = sorted(dayDict) if days is None else days
     for day in days:
-        plotData(dayDict[day][1], dayDict[day][0], interval)
+        plotData(dayDict[day].values, dayDict[day].hours(), interval)
     plt.legend(days, loc="upper right")
 
-def combineData(param, combine, days, option = "NA", interval = 2):
-    vals = []
-    times = []
-    for i in range(days[0], days[-1]+2):
-        df = pd.read_csv("pilot/201910"+str(i)+".csv")
-        a_channel = list(df[param].values)
-        if option == "average":
-            b_channel = list(df[param+"_b"].values)
-            avg = []
-            for i in range(len(a_channel)):
-                avg.append((a_channel[i] + b_channel[i]) / 2)
-            vals.extend(avg)
+def pilotProfiles(param, days, option = "NA", data = None, path = None, paths = None):
+    """ Returns the DailyProfiles of param for the given days, keyed by date (see
+    pilotDates). With a path, the stored profiles there are loaded, any of the days they
+    are missing are added from the pilot files (or the logs in paths, see pilotDays) and
+    the store is saved again. A store of another param, option or bin width is rebuilt """
+    profiles = diurnal.DailyProfiles(param=param, option=option)
+    if path is not None and os.path.exists(path):
+        stored = diurnal.DailyProfiles.load(path)
+        if stored.matches(param, option):
+            profiles = stored
         else:
-            vals.extend(a_channel)
-        times.extend(list(df["UTCDateTime"].values))
+            print("rebuilding %s: it holds %s (%s) profiles, not %s (%s)" % (path, stored.param, stored.option, param, option))
+    missing = [(day, date) for day, date in zip(days, pilotDates(days)) if date not in profiles.days]
+    if missing:
+        dayDict = pilotDays(param, [day for day, date in missing], option, data, paths)
+        for day, date in missing:
+            profiles.add_day(date, dayDict[day].hours(), dayDict[day].values)
+        if path is not None:
+            profiles.save(path)
+    return profiles
 
-    dayDict = organizeDays(vals, times)
+def combineData(param, combine, days, option = "NA", interval = 2, data = None):
+    """ Plots the average or median diurnal profile of param over the given days, in
+    time of day bins of diurnal.BIN_MINUTES """
+    if data is None:
+        data = PilotDataset(days, pilotColumns(param, option))
+    profiles = data.profiles(param, option)
     if combine == "average":
-        vals = dayDict[days[0]][1]
-        times = dayDict[days[0]][0]
-        for day in days[1:]:
-            vals = [a+b for a,b in zip(vals, dayDict[day][1])]
-        numDays = len(days)
-        vals = [x/numDays for x in vals]
+        vals = profiles.mean(pilotDates(days))
     elif combine == "median":
-        vals = []
-        times = dayDict[days[0]][0]
-        for i in range(len(times)):
-            valsToMedian = []
-            for day in days:
-                valsToMedian.append(dayDict[day][1][i])
-            vals.append(statistics.median(valsToMedian))
-    plotData(vals, times, interval)
-
-def allData(param, days, option = "NA", interval = 6, plot = True, trend = False, color = None):
-    vals = []
-    times = []
-    for i in range(days[0], days[-1]+2):
-        df = pd.read_csv("pilot/201910"+str(i)+".csv")
-        a_channel = list(df[param].values)
-        if option == "average":
-            b_channel = list(df[param+"_b"].values)
-            avg = []
-            for i in range(len(a_channel)):
-                avg.append((a_channel[i] + b_channel[i]) / 2)
-            vals.extend(avg)
-        else:
-            vals.extend(a_channel)
-        times.extend(list(df["UTCDateTime"].values))
-    
-    dayDict = organizeDays(vals, times)
-    allVals = []
-    allTimes = []
-    for day in days:
-        allVals.extend(dayDict[day][1])
-        allTimes.extend(dayDict[day][0])
+        vals = profiles.median(pilotDates(days))
+    plotData(vals, profiles.hours(), interval)
+
+def allData(param, days, option = "NA", interval = 6, plot = True, trend = False, color = None, data = None,
+            paths = None):
+    """ Plots param over all the given days back to back. With paths, the SD card logs
+    there are streamed (see pilotDays) and days are local dates, or None for every day in
+    the logs. With trend, a rolling TREND_STAT (or the rolling.trend statistic named by
+    trend) over TREND_WINDOW is drawn over it. Returns the values and their hours """
+    dayDict = pilotDays(param, days, option, data, paths)
+    days = sorted(dayDict) if days is None else days
+    signal = sensorseries.SensorSeries.concatenate([dayDict[day] for day in days])
+    allVals = signal.values
+    allTimes = signal.hours()
     if plot:
         plotData(allVals, allTimes, interval, color)
         if trend:
-            z = np.polyfit(list(range(len(allVals))), allVals, 10)
-            p = np.poly1d(z)
-            plt.plot(list(range(len(allVals))),p(list(range(len(allVals)))),"r--")
+            stat = TREND_STAT if trend is True else trend
+            trendVals = rolling.trend(signal.epoch, allVals, TREND_WINDOW, stat)
+            plt.plot(*decimate.decimate(np.arange(len(allVals)), trendVals), "r--")
     return allVals, allTimes
 
 def relevantHours(locs, hours, interval = 4):
-    ticks = []
-    evenHours = []
-    for i in range(len(hours)):
-        loc = locs[i]
-        hour = hours[i]
-        if hour % interval < .017:
-            ticks.append(loc)
-            evenHours.append(str(int(hour)))
-    return ticks, evenHours
+    locs = np.asarray(locs)
+    hours = np.asarray(hours)
+    onTick = hours % interval < .017
+    return list(locs[onTick]), [str(int(hour)) for hour in hours[onTick]]
 
 def plotData(vals, hours, interval = 4, color = None):
     """ Helper function for plotting data, where vals are the data values and hours
     are the fractional hours since the start of data collection. Hour ticks are placed
-    at interval hours apart """
-    locs = list(range(len(vals)))
+    at interval hours apart. Long series are decimated (see decimate.py) before plotting """
+    locs = np.arange(len(vals))
     ticks, evenHours = relevantHours(locs, hours, interval)
     plt.xticks(ticks, evenHours)
+    locs, vals = decimate.decimate(locs, vals)
     if color == None:
         plt.plot(locs, vals)
     else:
@@ -160,23 +313,26 @@ def plotData(vals, hours, interval = 4, color = None):
 
 def plotSensor(name, param, days, interval = 6):
     """ Helper function for plotting data for a sensor on the specified days """
-    outputs = background_sensors.get_signals([name], param, days)[0]
-    plotData(outputs[1], outputs[0], interval)
+    signal = background_sensors.get_signals([name], param, days)[0]
+    plotData(signal.values, signal.hours(), interval)
 
-def combineBackground(param, days, combine = "average"):
+def combineBackground(param, days, combine = "average", data = None, grid = None):
     """ Get the average or median of the background signals for the given parameter
-    on the specified days """
-    outputs = background_sensors.get_signals(BACKGROUND_SENSOR_NAMES, param, days)
-    outputs = background_sensors.align_signals(outputs)
-    signals = [x[1] for x in outputs]
-    if combine == "average":
-        return (background_sensors.average_signals(signals), outputs[0][0])
-    elif combine == "median":
-        return (background_sensors.median_signals(signals), outputs[0][0])
+    on the specified days. The signals are first aligned by timestamp onto grid (epoch
+    seconds, by default a regular grid over the period every sensor covers). Sensors
+    missing a sample at a grid time are left out of that time's combined value. combine
+    can also be "trimmed" or "percentile" (see background_sensors.reduce_signals).
+    Returns a SensorSeries on the grid """
+    if data is None:
+        outputs = background_sensors.get_signals(BACKGROUND_SENSOR_NAMES, param, days, BACKGROUND_WORKERS)
+    else:
+        outputs = data.backgroundSignals(BACKGROUND_SENSOR_NAMES, param, days)
+    outputs = background_sensors.align_signals(outputs, grid)
+    return background_sensors.reduce_signals(outputs, combine)
 
-def plotBackground(param, days, combine = "average", interval = 6, color=None):
-    vals, times = combineBackground(param, days, combine)
-    plotData(vals, times, interval, color)
+def plotBackground(param, days, combine = "average", interval = 6, color=None, data = None, grid = None):
+    background = combineBackground(param, days, combine, data, grid)
+    plotData(background.values, background.hours(), interval, color)
 
 def plotSensorsAndAverage():
     plotBackground("PM2.5_CF1_ug/m3", [12], "average", 2)
@@ -192,10 +348,17 @@ def plotSensorsAndMedian():
     plt.legend(["Average"]+BACKGROUND_SENSOR_NAMES)
     plt.show()
 
-def plotBackgroundMedAndPilot():
+def figureDataset():
+    """ A PilotDataset holding the pilot data used by every report figure """
+    return PilotDataset(range(10, 22), pilotColumns("pm2_5_atm", "average") + pilotColumns("pm2_5_cf_1", "average"))
+
+def plotBackgroundMedAndPilot(data = None):
     """ Figure 3. Plots the median of the background signals against the pilot sensor signal """
-    plotBackground("PM2.5_ATM_ug/m3", list(range(10, 22)), "median", 6, color="#009933")
-    allData("pm2_5_atm", list(range(10, 22)), "average", 6, color="#00004d")
+    if data is None:
+        data = PilotDataset(range(10, 22), pilotColumns("pm2_5_atm", "average"))
+    pilot_times = data.series("pm2_5_atm", "average", list(range(10, 22))).epoch
+    plotBackground("PM2.5_ATM_ug/m3", list(range(10, 22)), "median", 6, color="#009933", data=data, grid=pilot_times)
+    allData("pm2_5_atm", list(range(10, 22)), "average", 6, color="#00004d", data=data)
     plt.legend(["Background Median", "Pilot Sensor"])
     plt.title("PM$_{2.5}$ Pilot Sensor vs Median Background Data (Oct 10th-21st)")
     plt.ylabel("PM$_{2.5}$ Concentration [$\mu$g/m$^3$]")
@@ -205,16 +368,14 @@ def plotBackgroundMedAndPilot():
         plt.axvline(x=722*i+435, color=(0, 0, 1))
     plt.show()
 
-def plotBackMedAndPilotDifference():
+def plotBackMedAndPilotDifference(data = None):
     """ Figure 4 """
-    med_signal, times = combineBackground("PM2.5_ATM_ug/m3", list(range(10, 22)), "median")
-    pilot_signal, pilot_times = allData("pm2_5_atm", list(range(10, 22)), "average", 6, False)
-    minLength = min(len(med_signal), len(pilot_signal))
-    med_signal = med_signal[:minLength]
-    times = times[:minLength]
-    pilot_signal = pilot_signal[:minLength]
+    if data is None:
+        data = PilotDataset(range(10, 22), pilotColumns("pm2_5_atm", "average"))
+    pilot_signal = data.series("pm2_5_atm", "average", list(range(10, 22)))
+    med_signal = combineBackground("PM2.5_ATM_ug/m3", list(range(10, 22)), "median", data, pilot_signal.epoch)
     diff_signal = background_sensors.subtract_signals(pilot_signal, med_signal)
-    plotData(diff_signal, times, 6, color="#00004d")
+    plotData(diff_signal.values, diff_signal.hours(), 6, color="#00004d")
     plt.title("PM$_{2.5}$ Pilot Minus Median Background (Oct 10th-21st)")
     plt.ylabel("Difference in PM$_{2.5}$ Concentration [$\mu$g/m$^3$]")
     plt.xlabel("Time [hour]")
@@ -223,23 +384,36 @@ def plotBackMedAndPilotDifference():
         plt.axvline(x=722*i+435, color=(0, 0, 1))
     plt.show()
 
-def avgDiffTimeRange(start, end, days):
-    med_signal, times = combineBackground("PM2.5_CF1_ug/m3", days, "median")
-    pilot_signal, pilot_times = allData("pm2_5_cf_1", days, "average", 6, False)
-    minLength = min(len(med_signal), len(pilot_signal))
-    med_signal = med_signal[:minLength]
-    times = times[:minLength]
-    pilot_signal = pilot_signal[:minLength]
+def diffIndex(days, data = None):
+    """ A diurnal.TimeOfDayIndex of the pilot minus median background PM2.5 (CF1)
+    difference on the given days """
+    if data is None:
+        data = PilotDataset(days, pilotColumns("pm2_5_cf_1", "average"))
+    pilot_signal = data.series("pm2_5_cf_1", "average", days)
+    med_signal = combineBackground("PM2.5_CF1_ug/m3", days, "median", data, pilot_signal.epoch)
     diff_signal = background_sensors.subtract_signals(pilot_signal, med_signal)
-    relevantVals = []
-    for i in range(len(times)):
-        if (times[i] >= start) and (times[i] <= end):
-            relevantVals.append(diff_signal[i])
-    print(statistics.mean(relevantVals))
+    return diurnal.TimeOfDayIndex(diff_signal.hours(), diff_signal.values)
+
+def diffTimeRanges(starts, ends, days, stat = "mean", q = 50, data = None):
+    """ Returns the mean, median or qth percentile ("percentile") of the pilot minus
+    median background difference in each of the [start, end] hour windows. Raises
+    ValueError for any other stat """
+    if stat not in ("mean", "median", "percentile"):
+        raise ValueError("unknown stat " + str(stat))
+    index = diffIndex(days, data)
+    if stat == "mean":
+        return index.mean(starts, ends)
+    elif stat == "median":
+        return index.median(starts, ends)
+    elif stat == "percentile":
+        return index.percentile(starts, ends, q)
 
-def pilotWithTrend():
+def avgDiffTimeRange(start, end, days, data = None):
+    print(diffTimeRanges(start, end, days, "mean", data=data))
+
+def pilotWithTrend(data = None):
     """ Figure 1. Plots the pilot sensor data with a trendline """
-    allData("pm2_5_atm", list(range(10, 22)), "average", 6, True, trend=True, color="#00004d")
+    allData("pm2_5_atm", list(range(10, 22)), "average", 6, True, trend=True, color="#00004d", data=data)
     plt.title("PM$_{2.5}$ Pilot Sensor (Oct 10th-21st)")
     plt.ylabel("PM$_{2.5}$ Concentration [$\mu$g/m$^3$]")
     plt.xlabel("Time [hour]")
@@ -248,12 +422,14 @@ def pilotWithTrend():
         plt.axvline(x=722*i+435, color=(0, 0, 1))
     plt.show()
 
-def weekendWeekdays():
+def weekendWeekdays(data = None):
     """ Figure 2. Plots the average and median signals for weekends versus non-Wednesday weekdays """
-    combineData("pm2_5_atm", "average", [10, 11, 14, 15, 17, 18, 21], "average")
-    combineData("pm2_5_atm", "median", [10, 11, 14, 15, 17, 18, 21], "average")
-    combineData("pm2_5_atm", "average", [12, 13, 19, 20], "average")
-    combineData("pm2_5_atm", "median", [12, 13, 19, 20], "average")
+    if data is None:
+        data = PilotDataset(range(10, 22), pilotColumns("pm2_5_atm", "average"))
+    combineData("pm2_5_atm", "average", [10, 11, 14, 15, 17, 18, 21], "average", data=data)
+    combineData("pm2_5_atm", "median", [10, 11, 14, 15, 17, 18, 21], "average", data=data)
+    combineData("pm2_5_atm", "average", [12, 13, 19, 20], "average", data=data)
+    combineData("pm2_5_atm", "median", [12, 13, 19, 20], "average", data=data)
     plt.legend(["Non-Wed Weekdays Average", "Non-Wed Weekdays Median", "Weekends Average", "Weekends Median"])
     plt.title("Pilot Sensor Non-Wed Weekdays vs Weekends (Oct 10th-21st)")
     plt.ylabel("PM$_{2.5}$ Concentration [$\mu$g/m$_3$]")
@@ -265,8 +441,33 @@ def weekendWeekdays():
     plt.axvline(x=450, color=(0, 0, 1))
     plt.show()
 
+def benchmarkFigures():
+    """ Generates every report figure twice off screen, first with each figure reading
+    its own data and then from one shared PilotDataset, printing the time taken and the
+    number of csv parses, cache archive loads and store queries for each run """
+    backend = plt.get_backend()
+    plt.switch_backend("Agg")
+    figures = [pilotWithTrend, weekendWeekdays, plotBackgroundMedAndPilot, plotBackMedAndPilotDifference]
+    for shared in [False, True]:
+        before = dict(csvcache.READS, **store.QUERIES)
+        start = time.perf_counter()
+        data = figureDataset() if shared else None
+        for figure in figures:
+            figure(data)
+            plt.close("all")
+        avgDiffTimeRange(7.5, 8.5, list(range(10, 22)), data)
+        elapsed = time.perf_counter() - start
+        csvReads = csvcache.READS["csv"] - before["csv"]
+        cacheReads = csvcache.READS["cache"] - before["cache"]
+        queries = store.QUERIES["query"] - before["query"]
+        label = "shared dataset" if shared else "separate reads"
+        print(label+": %.2f s, %d csv parses, %d cache loads, %d store queries" % (elapsed, csvReads, cacheReads, queries))
+    plt.switch_backend(backend)
+
 def main():
     #avgDiffTimeRange(7.5, 8.5, [10, 11, 14, 15, 16, 17, 18, 21])
+    #starts, ends = diurnal.windows(0, 24, 0.5)
+    #print(diffTimeRanges(starts, ends, [10, 11, 14, 15, 16, 17, 18, 21]))
     pilotWithTrend()
 
 if __name__ == "__main__":
@@ -0,0 +1,58 @@
+###
+# Fusion of the two laser counters (a and b channels) in a PurpleAir sensor. The
+# channels are averaged sample by sample, matching them by timestamp when they come
+# from separate files, and samples where the channels disagree are flagged. Following
+# the usual PurpleAir QC, a sample is rejected when the channels differ by more than
+# ABSOLUTE_LIMIT ug/m3 and by more than RELATIVE_LIMIT of their mean
+###
+
+import numpy as np
+import timeparse
+import timegrid
+
+ABSOLUTE_LIMIT = 5
+RELATIVE_LIMIT = 0.7
+
+def disagreement(a, b, absolute = ABSOLUTE_LIMIT, relative = RELATIVE_LIMIT):
+    """ Returns a boolean array marking the samples where the channels disagree beyond
+    both limits. Samples missing either channel are never marked """
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    diff = np.abs(a - b)
+    mean = (a + b) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relDiff = np.where(mean != 0, diff / np.abs(mean), np.where(diff > 0, np.inf, 0))
+    return (diff > absolute) & (relDiff > relative)
+
+def fuse_channels(a, b, times_a = None, times_b = None, absolute = ABSOLUTE_LIMIT,
+                  relative = RELATIVE_LIMIT, drop = False, tolerance = timegrid.TOLERANCE):
+    """ Averages the a and b channel values. If the channels were logged separately, give
+    their epoch second times and each a sample is paired with the nearest b sample within
+    tolerance seconds; a samples without a partner keep their a value. Returns the fused
+    values (on the a samples) and a boolean array of rejected samples. With drop the
+    rejected samples are nan in the fused values """
+    a = np.asarray(a, dtype=float)
+    if times_a is not None:
+        b = timegrid.resample(times_a, times_b, b, "nearest", tolerance)
+    else:
+        b = np.asarray(b, dtype=float)
+    fused = np.where(np.isnan(b), a, (a + b) / 2) if times_a is not None else (a + b) / 2
+    rejected = disagreement(a, b, absolute, relative)
+    if drop:
+        fused[rejected] = np.nan
+    return fused, rejected
+
+def count_by_day(epoch, flags, tz = timeparse.LOCAL_TZ):
+    """ Returns a dict mapping each local day of the month to the number of flagged
+    samples on that day """
+    days = timeparse.local_day_hours(epoch, tz)[0]
+    flags = np.asarray(flags, dtype=bool)
+    return {day: int(np.count_nonzero(flags[pos])) for day, pos in timeparse.split_days(days).items()}
+
+def split_columns(columns):
+    """ Splits the columns of a PurpleAir SD card log (a dict of name to values) into those
+    of the a channel and those of the b channel, whose "_b" names lose the suffix so both
+    channels share parameter names. Columns without a b counterpart go with the a channel """
+    a = {name: vals for name, vals in columns.items() if not (name.endswith("_b") and name[:-2] in columns)}
+    b = {name[:-2]: vals for name, vals in columns.items() if name.endswith("_b") and name[:-2] in columns}
+    return a, b
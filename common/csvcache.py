@@ -0,0 +1,161 @@
+###
+# On-disk cache for the columns of sensor csvs. The first time a column is requested
+# it is parsed from the csv and saved to a numpy archive (.npz) in a
+# .csvcache directory next to the csv, with any time column stored as int64 epoch
+# seconds (timeparse.NAT where the time cannot be parsed) under a name that includes
+# the format and time zone it was parsed with. Later reads load only the
+# requested columns from the archive. An archive is thrown away when the modification
+# time or size of its csv changes, or when it was written by an older version of this
+# module
+###
+
+import os
+import numpy as np
+import pandas as pd
+import timeparse
+
+CACHE_DIR = ".csvcache"
+
+# Stored in every archive's stamp, and raised when the archive contents change meaning
+VERSION = 3
+
+# Number of csv parses and archive loads so far, for benchmarking
+READS = {"csv": 0, "cache": 0}
+
+BLOCK_BYTES = 1 << 24 # read at a time when scanning a csv for merged lines
+
+def merged_lines(path, skiprows = 0, block = BLOCK_BYTES):
+    """ Returns the line numbers (from 0, as for the skiprows of pd.read_csv) of the lines
+    after the header on line skiprows with more fields than it, which the logger wrote
+    as two lines merged into one. Fields are counted by commas, so lines with quotes are
+    never counted. The file is scanned a block at a time """
+    merged = []
+    state = {"line": 0, "fields": None}
+    def scan(buf):
+        data = np.frombuffer(buf, dtype=np.uint8)
+        starts = np.r_[0, np.flatnonzero(data == ord("\n"))[:-1] + 1]
+        commas = np.add.reduceat(data == ord(","), starts)
+        quoted = np.add.reduceat(data == ord('"'), starts) > 0
+        numbers = state["line"] + np.arange(len(starts))
+        if state["fields"] is None and skiprows < numbers[-1] + 1:
+            state["fields"] = commas[skiprows - state["line"]]
+        if state["fields"] is not None:
+            merged.extend(numbers[(numbers > skiprows) & (commas > state["fields"]) & ~quoted].tolist())
+        state["line"] += len(starts)
+    with open(path, "rb") as f:
+        carry = b""
+        for chunk in iter(lambda: f.read(block), b""):
+            data = carry + chunk
+            cut = data.rfind(b"\n") + 1
+            if cut:
+                scan(data[:cut])
+            carry = data[cut:]
+        if carry:
+            scan(carry + b"\n")
+    return merged
+
+def read_csv(path, usecols = None, skiprows = 0, chunksize = None, **kwargs):
+    """ pd.read_csv of the csv whose header is on line skiprows, leaving out merged lines
+    (see merged_lines), which pandas would otherwise cut short, or if the first line is
+    merged, use to shift every line onto an index. Lines with fewer fields are kept.
+    Returns an iterator of DataFrames of chunksize rows if chunksize is given """
+    merged = merged_lines(path, skiprows)
+    if merged:
+        skiprows = list(range(skiprows)) + merged
+    return pd.read_csv(path, usecols=usecols, skiprows=skiprows, chunksize=chunksize, **kwargs)
+
+def cache_path(path):
+    """ Returns the location of the archive for the csv at path """
+    return os.path.join(os.path.dirname(path), CACHE_DIR, os.path.basename(path) + ".npz")
+
+def _stamp(path):
+    stat = os.stat(path)
+    return np.array([stat.st_mtime_ns, stat.st_size, VERSION], dtype=np.int64)
+
+def _load(path, stamp):
+    """ Returns the header and the lazily loaded archive for the csv, or None if there is
+    no archive or it is out of date """
+    try:
+        archive = np.load(cache_path(path))
+    except (OSError, ValueError):
+        return None
+    if not np.array_equal(archive["stamp"], stamp):
+        archive.close()
+        return None
+    return archive
+
+def _save(path, stamp, header, arrays):
+    """ Writes the header and the column arrays (keyed by column name) to the archive """
+    os.makedirs(os.path.dirname(cache_path(path)), exist_ok=True)
+    names = list(arrays)
+    stored = {"c"+str(i): arrays[name] for i, name in enumerate(names)}
+    tmpPath = cache_path(path) + ".tmp.npz"
+    np.savez(tmpPath, stamp=stamp, header=np.array(header, dtype=str), names=np.array(names, dtype=str), **stored)
+    os.replace(tmpPath, cache_path(path))
+
+def _time_key(time_column, time_format, tz):
+    """ The name a time column parsed with time_format and tz is stored under, so that
+    reading it with another format or time zone parses it again """
+    return "%s|%s|%s" % (time_column, time_format, tz)
+
+def columns(path, skiprows = 0):
+    """ Returns the list of column names in the csv, whose header is on line skiprows """
+    archive = _load(path, _stamp(path))
+    if archive is not None:
+        READS["cache"] += 1
+        with archive:
+            return archive["header"].tolist()
+    READS["csv"] += 1
+    return pd.read_csv(path, nrows=0, skiprows=skiprows).columns.tolist()
+
+def read_columns(path, names, time_column = None, time_format = None, tz = "UTC", skiprows = 0):
+    """ Returns a dict mapping each of the requested column names to a numpy array. If
+    time_column is given it is also returned, converted to epoch seconds with
+    timeparse.parse_epoch using time_format and tz, and the rows whose time cannot be
+    parsed are left out of every column. skiprows is the number of lines before the
+    header. Raises KeyError if a column is not in the csv """
+    wanted = list(names)
+    if time_column is not None and time_column not in wanted:
+        wanted.append(time_column)
+    keys = {name: name for name in wanted} # the stored name of each column
+    if time_column is not None:
+        keys[time_column] = _time_key(time_column, time_format, tz)
+    stamp = _stamp(path)
+    cached = {}
+    header = None
+    archive = _load(path, stamp)
+    if archive is not None:
+        READS["cache"] += 1
+        with archive:
+            header = archive["header"].tolist()
+            stored = archive["names"].tolist()
+            for i, name in enumerate(stored):
+                cached[name] = archive["c"+str(i)] if name in keys.values() else None
+    missing = [name for name in wanted if keys[name] not in cached]
+    if missing:
+        if header is None:
+            header = pd.read_csv(path, nrows=0, skiprows=skiprows).columns.tolist()
+        absent = [name for name in missing if name not in header]
+        if absent:
+            raise KeyError(str(absent) + " not in " + path)
+        READS["csv"] += 1
+        df = read_csv(path, missing, skiprows)
+        for name in missing:
+            if name == time_column:
+                cached[keys[name]] = timeparse.parse_epoch(df[name], time_format, tz)[0]
+            elif df[name].dtype.kind in "biuf":
+                cached[name] = df[name].to_numpy()
+            else:
+                cached[name] = df[name].to_numpy(dtype=str)
+        # reload the columns that were cached but not requested so the rewrite keeps them
+        if archive is not None and any(x is None for x in cached.values()):
+            with np.load(cache_path(path)) as old:
+                for i, name in enumerate(old["names"].tolist()):
+                    if cached[name] is None:
+                        cached[name] = old["c"+str(i)]
+        _save(path, stamp, header, cached)
+    if time_column is not None:
+        valid = cached[keys[time_column]] != timeparse.NAT
+        if not valid.all():
+            return {name: cached[keys[name]][valid] for name in wanted}
+    return {name: cached[keys[name]] for name in wanted}
@@ -0,0 +1,80 @@
+###
+# Decimation of long series before plotting. The x range is split into buckets (about
+# one per pixel column) and only the lowest and highest point of each bucket are drawn,
+# so peaks stay visible while matplotlib renders a bounded number of points
+###
+
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+
+MAX_POINTS = 4000
+
+def minmax_indices(x, y, max_points = MAX_POINTS):
+    """ Returns the sorted indices of the points to draw: the first and last points and,
+    for each of max_points // 2 equal width x buckets, the points with the lowest and
+    highest y. Buckets holding only nan keep one nan point so gaps in a line still show.
+    Series of at most max_points points are kept whole """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(y) <= max_points:
+        return np.arange(len(y))
+    numBuckets = max(max_points // 2, 1)
+    low, high = np.nanmin(x), np.nanmax(x)
+    if high > low:
+        buckets = np.minimum(((x - low) / (high - low) * numBuckets).astype(int), numBuckets-1)
+    else:
+        buckets = np.zeros(len(x), dtype=int)
+    keep = [np.array([0, len(y)-1])]
+    finite = ~np.isnan(y)
+    if np.all(buckets[1:] >= buckets[:-1]):
+        # x in order, so every bucket is a contiguous segment and one pass finds its extremes
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        lengths = np.diff(np.r_[starts, len(y)])
+        segment = np.repeat(np.arange(len(starts)), lengths)
+        for reduce in (np.fmin, np.fmax):
+            extreme = np.repeat(reduce.reduceat(y, starts), lengths)
+            hits = np.flatnonzero(y == extreme)
+            keep.append(hits[np.unique(segment[hits], return_index=True)[1]])
+        hasFinite = np.logical_or.reduceat(finite, starts)
+        keep.append(starts[~hasFinite])
+    else:
+        index = np.flatnonzero(finite)
+        order = index[np.lexsort((y[index], buckets[index]))]
+        sortedBuckets = buckets[order]
+        firsts = np.flatnonzero(np.r_[True, sortedBuckets[1:] != sortedBuckets[:-1]])
+        lasts = np.r_[firsts[1:] - 1, len(order) - 1]
+        keep += [order[firsts], order[lasts]]
+        missing = np.flatnonzero(~finite)
+        emptyBuckets, first = np.unique(buckets[missing], return_index=True)
+        empty = ~np.isin(emptyBuckets, sortedBuckets)
+        keep.append(missing[first[empty]])
+    return np.unique(np.concatenate(keep))
+
+def decimate(x, y, max_points = MAX_POINTS):
+    """ Returns the x and y arrays reduced to the points chosen by minmax_indices """
+    keep = minmax_indices(x, y, max_points)
+    return np.asarray(x)[keep], np.asarray(y)[keep]
+
+def benchmark_render(num_points = 1000000, max_points = MAX_POINTS):
+    """ Prints the time taken to draw a random walk of num_points points as a line and as
+    a scatter plot off screen, raw and decimated (including the decimation) """
+    backend = plt.get_backend()
+    plt.switch_backend("Agg")
+    rng = np.random.default_rng(0)
+    x = np.arange(num_points)
+    y = np.cumsum(rng.normal(size=num_points))
+    for kind in ["line", "scatter"]:
+        for label in ["raw", "decimated"]:
+            fig, ax = plt.subplots()
+            start = time.perf_counter()
+            xs, ys = decimate(x, y, max_points) if label == "decimated" else (x, y)
+            if kind == "line":
+                ax.plot(xs, ys)
+            else:
+                ax.scatter(xs, ys, s=4)
+            fig.canvas.draw()
+            elapsed = time.perf_counter() - start
+            plt.close(fig)
+            print("%s %s (%d points): %.3f s" % (kind, label, len(xs), elapsed))
+    plt.switch_backend(backend)
@@ -0,0 +1,155 @@
+###
+# Incremental store of diurnal (time of day) profiles. Each day's samples are reduced
+# once to per-bin count, sum and sum of squares, so average, standard deviation and
+# median profiles for any set of days come from these small per-day rows instead of
+# re-reading and re-combining the raw data. New days can be added as they arrive and
+# the store saved to and loaded from a numpy archive
+###
+
+import datetime
+import numpy as np
+
+BIN_MINUTES = 2
+
+class DailyProfiles:
+    """ Per day, per time of day bin aggregates of one signal. Days are datetime.date,
+    and param and option name the signal so that a saved store is only reused for it """
+
+    def __init__(self, bin_minutes = BIN_MINUTES, param = None, option = None):
+        self.bin_minutes = bin_minutes
+        self.param = param
+        self.option = option
+        self.num_bins = int(round(24 * 60 / bin_minutes))
+        self.days = []
+        self.counts = np.zeros((0, self.num_bins))
+        self.sums = np.zeros((0, self.num_bins))
+        self.sumsqs = np.zeros((0, self.num_bins))
+
+    def hours(self):
+        """ The fractional hour at the start of each bin """
+        return np.arange(self.num_bins) * self.bin_minutes / 60
+
+    def add_day(self, day, hours, vals, replace = True):
+        """ Adds (or with replace, overwrites) the aggregates for day from the samples at
+        the fractional hours. nan values are ignored """
+        if day in self.days and not replace:
+            return
+        hours = np.asarray(hours, dtype=float)
+        vals = np.asarray(vals, dtype=float)
+        keep = ~np.isnan(vals)
+        bins = np.clip((hours[keep] * 60 // self.bin_minutes).astype(int), 0, self.num_bins-1)
+        rows = [np.bincount(bins, weights, self.num_bins) for weights in (None, vals[keep], vals[keep]**2)]
+        if day in self.days:
+            i = self.days.index(day)
+            self.counts[i], self.sums[i], self.sumsqs[i] = rows
+        else:
+            self.days.append(day)
+            self.counts = np.vstack([self.counts, rows[0]])
+            self.sums = np.vstack([self.sums, rows[1]])
+            self.sumsqs = np.vstack([self.sumsqs, rows[2]])
+
+    def _rows(self, days):
+        return [self.days.index(day) for day in days]
+
+    def mean(self, days):
+        """ The average profile over every sample on the given days """
+        rows = self._rows(days)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sums[rows].sum(axis=0) / self.counts[rows].sum(axis=0)
+
+    def std(self, days):
+        """ The standard deviation profile over every sample on the given days """
+        rows = self._rows(days)
+        count = self.counts[rows].sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self.sums[rows].sum(axis=0) / count
+            return np.sqrt(np.maximum(self.sumsqs[rows].sum(axis=0) / count - mean**2, 0))
+
+    def day_means(self, days):
+        """ A (days x bins) array of each day's bin averages, nan for empty bins """
+        rows = self._rows(days)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.sums[rows] / self.counts[rows]
+
+    def median(self, days):
+        """ The median across the given days of each day's bin average """
+        means = self.day_means(days)
+        output = np.full(self.num_bins, np.nan)
+        present = ~np.all(np.isnan(means), axis=0)
+        output[present] = np.nanmedian(means[:, present], axis=0)
+        return output
+
+    def matches(self, param, option, bin_minutes = BIN_MINUTES):
+        """ Whether these are profiles of param with the channel option in bins of
+        bin_minutes """
+        return (self.param, self.option, self.bin_minutes) == (param, option, bin_minutes)
+
+    def save(self, path):
+        np.savez(path, bin_minutes=self.bin_minutes, param=str(self.param), option=str(self.option),
+                 days=np.array([day.isoformat() for day in self.days], dtype=str),
+                 counts=self.counts, sums=self.sums, sumsqs=self.sumsqs)
+
+    @classmethod
+    def load(cls, path):
+        """ Loads a saved store. Stores saved without a param and option (or with days as
+        day numbers) load with param None, so they match no signal """
+        with np.load(path) as archive:
+            if "param" not in archive:
+                return cls(int(archive["bin_minutes"]))
+            profiles = cls(int(archive["bin_minutes"]), str(archive["param"]), str(archive["option"]))
+            profiles.days = [datetime.date.fromisoformat(day) for day in archive["days"]]
+            profiles.counts = archive["counts"]
+            profiles.sums = archive["sums"]
+            profiles.sumsqs = archive["sumsqs"]
+        return profiles
+
+class TimeOfDayIndex:
+    """ Values sorted by their fractional hour of the day, with prefix sums, so that
+    statistics over many time of day windows can be answered with binary searches
+    instead of a scan of every sample per window """
+
+    def __init__(self, hours, vals):
+        hours = np.asarray(hours, dtype=float)
+        vals = np.asarray(vals, dtype=float)
+        keep = ~np.isnan(vals)
+        order = np.argsort(hours[keep], kind="stable")
+        self.hours = hours[keep][order]
+        self.vals = vals[keep][order]
+        self.prefix = np.concatenate([[0], np.cumsum(self.vals)])
+
+    def bounds(self, starts, ends):
+        """ The positions of the first and one past the last sample in each of the
+        [start, end] hour windows """
+        return (np.searchsorted(self.hours, starts, "left"), np.searchsorted(self.hours, ends, "right"))
+
+    def window(self, start, end):
+        """ The values in the [start, end] hour window, as a view """
+        low, high = self.bounds(start, end)
+        return self.vals[low:high]
+
+    def counts(self, starts, ends):
+        low, high = self.bounds(starts, ends)
+        return high - low
+
+    def mean(self, starts, ends):
+        """ The mean of each [start, end] window (nan if empty), in O(log n) per window """
+        low, high = self.bounds(starts, ends)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self.prefix[high] - self.prefix[low]) / (high - low)
+
+    def percentile(self, starts, ends, q):
+        """ The qth percentile of each [start, end] window (nan if empty) """
+        low, high = self.bounds(np.atleast_1d(starts), np.atleast_1d(ends))
+        output = np.full(len(low), np.nan)
+        for i in range(len(low)):
+            if high[i] > low[i]:
+                output[i] = np.percentile(self.vals[low[i]:high[i]], q)
+        return output if np.ndim(starts) else output[0]
+
+    def median(self, starts, ends):
+        return self.percentile(starts, ends, 50)
+
+def windows(start, end, width):
+    """ Returns the starts and ends of consecutive width hour windows from start to end """
+    starts = np.arange(start, end, width)
+    return starts, np.minimum(starts + width, end)
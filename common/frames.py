@@ -0,0 +1,131 @@
+###
+# Frame generation and rendering for the animations. A series sampled every minute (or
+# second) is upsampled to a fixed number of frames per sample in one vectorized pass
+# over the whole series, so the line in the animation moves smoothly between samples.
+# Frames are drawn off screen with Agg: the static parts of the figure are drawn once,
+# and each frame restores them and draws the lines as views of the full series arrays.
+# The raw frame buffers are piped to ffmpeg, optionally in chunks by several processes
+###
+
+import os
+import pickle
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+def frame_positions(x, per_step):
+    """ Returns the per_step evenly spaced positions in [x[i], x[i+1]) for every pair of
+    consecutive samples, followed by the last sample """
+    x = np.asarray(x, dtype=float)
+    if len(x) < 2:
+        return x.copy()
+    steps = np.arange(per_step) / per_step
+    inner = x[:-1, None] + steps[None, :] * np.diff(x)[:, None]
+    return np.append(inner.ravel(), x[-1])
+
+def upsample(x, y, per_step, method = "linear"):
+    """ Returns the frame positions and values of the series (x, y) with per_step frames
+    per sample. "linear" joins the samples with straight lines and "pchip" with a
+    monotone cubic, which passes through every sample without overshooting it """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    xs = frame_positions(x, per_step)
+    if len(x) < 2:
+        return xs, y.copy()
+    steps = np.arange(per_step) / per_step
+    inner = y[:-1, None] + steps[None, :] * np.diff(y)[:, None]
+    linear = np.append(inner.ravel(), y[-1])
+    if method == "linear":
+        return xs, linear
+    if method == "pchip":
+        # the interpolator needs strictly increasing x and finite y, so repeated times keep
+        # their first value and steps next to a missing sample stay nan as in "linear"
+        from scipy import interpolate # only imported when needed, as it is slow to import
+        finite = np.isfinite(y)
+        unique, first = np.unique(x[finite], return_index=True)
+        if len(unique) < 2:
+            return xs, linear
+        ys = interpolate.PchipInterpolator(unique, y[finite][first])(xs)
+        ys[np.isnan(linear)] = np.nan
+        return xs, ys
+    raise ValueError("method must be linear or pchip, not " + str(method))
+
+def ffmpeg_command(ffmpeg, size, fps, path, bitrate = 1800):
+    """ Returns the command that encodes raw rgba frames of size (width, height) read from
+    stdin into the video at path """
+    return [ffmpeg, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgba", "-s", "%dx%d" % size, "-r", str(fps), "-i", "-",
+            "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-c:v", "libx264", "-pix_fmt", "yuv420p",
+            "-b:v", "%dk" % bitrate, path]
+
+def _render_frames(fig, lines, data, start, end, path, fps, ffmpeg, bitrate):
+    """ Draws frames start to end - 1 and pipes them to ffmpeg (or discards them if path is
+    None). Frame i shows the first i + 1 points of every series """
+    canvas = FigureCanvasAgg(fig)
+    legends = [ax.get_legend() for ax in fig.axes if ax.get_legend() is not None]
+    for artist in list(lines) + legends:
+        artist.set_animated(True)
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    proc = None
+    if path is not None:
+        size = canvas.get_width_height()
+        proc = subprocess.Popen(ffmpeg_command(ffmpeg, size, fps, path, bitrate), stdin=subprocess.PIPE)
+    try:
+        for i in range(start, end):
+            canvas.restore_region(background)
+            for line, (xs, ys) in zip(lines, data):
+                line.set_data(xs[:i+1], ys[:i+1])
+                line.axes.draw_artist(line)
+            for legend in legends:
+                legend.axes.draw_artist(legend)
+            if proc is not None:
+                proc.stdin.write(canvas.buffer_rgba())
+    finally:
+        if proc is not None:
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise RuntimeError("ffmpeg failed writing " + path)
+
+def _render_chunk(args):
+    figure, start, end, path, fps, ffmpeg, bitrate = args
+    fig, lines, data = pickle.loads(figure)
+    _render_frames(fig, lines, data, start, end, path, fps, ffmpeg, bitrate)
+
+def render(fig, lines, data, path, fps, ffmpeg = None, bitrate = 1800, workers = 1):
+    """ Renders an animation in which each line in lines grows along its (xs, ys) series
+    in data, one point per frame, and encodes it at fps frames per second to path with
+    ffmpeg (matplotlib's animation.ffmpeg_path by default). With path None the frames are
+    only drawn. With workers greater than 1 the frames are split into that many chunks
+    which are encoded by separate processes and joined. Prints and returns the number
+    of frames rendered per second """
+    if ffmpeg is None:
+        ffmpeg = matplotlib.rcParams["animation.ffmpeg_path"]
+    data = [(np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)) for xs, ys in data]
+    numFrames = max(len(xs) for xs, _ in data)
+    start = time.perf_counter()
+    if workers <= 1 or path is None:
+        _render_frames(fig, lines, data, 0, numFrames, path, fps, ffmpeg, bitrate)
+    else:
+        figure = pickle.dumps((fig, lines, data))
+        bounds = np.linspace(0, numFrames, workers + 1).astype(int)
+        parts = [path + ".part%d.mp4" % i for i in range(workers)]
+        jobs = [(figure, bounds[i], bounds[i+1], parts[i], fps, ffmpeg, bitrate) for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_render_chunk, jobs))
+        listPath = path + ".parts.txt"
+        with open(listPath, "w") as f:
+            f.writelines("file '%s'\n" % os.path.abspath(part) for part in parts)
+        try:
+            subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                            "-i", listPath, "-c", "copy", path], check=True)
+        finally:
+            for leftover in parts + [listPath]:
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+    rate = numFrames / (time.perf_counter() - start)
+    print("rendered %d frames at %.1f frames per second" % (numFrames, rate))
+    return rate
@@ -0,0 +1,163 @@
+###
+# Rolling statistics over time windows, for trend lines on series of any length. Each
+# sample's window holds the samples whose times fall within window of it (trailing, or
+# centered on it), so gaps in the data shrink the window instead of stretching it. The
+# mean comes from cumulative sums, the median from two heaps that samples enter and
+# leave as the window slides, and the minimum and maximum from monotonic deques. nan
+# values are left out of every window
+###
+
+import heapq
+import time
+from collections import deque
+import numpy as np
+
+def bounds(times, window, center = False):
+    """ Returns the start and end (exclusive) positions of each sample's window in the
+    sorted times: the samples in (t - window, t], or in [t - window/2, t + window/2] if
+    center. window is in the units of times """
+    times = np.asarray(times)
+    if center:
+        return np.searchsorted(times, times - window / 2, side="left"), np.searchsorted(times, times + window / 2, side="right")
+    return np.searchsorted(times, times - window, side="right"), np.arange(1, len(times) + 1)
+
+def mean(times, values, window, center = False):
+    """ The mean of each sample's window, in O(n) """
+    values = np.asarray(values, dtype=float)
+    starts, ends = bounds(times, window, center)
+    finite = np.isfinite(values)
+    sums = np.r_[0, np.cumsum(np.where(finite, values, 0))]
+    counts = np.r_[0, np.cumsum(finite)]
+    n = counts[ends] - counts[starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(n > 0, (sums[ends] - sums[starts]) / n, np.nan)
+
+def median(times, values, window, center = False):
+    """ The median of each sample's window. The lower half of the window is kept in a max
+    heap and the upper half in a min heap; samples leaving the window are only marked and
+    dropped once they reach the top of their heap. O(n log n) """
+    starts, ends = [x.tolist() for x in bounds(times, window, center)]
+    values = np.asarray(values, dtype=float).tolist() # python floats index far faster in the loop
+    output = np.full(len(values), np.nan)
+    low, high = [], [] # (-value, index) and (value, index)
+    side = [0] * len(values) # 1 in low, 2 in high, 0 in neither
+    sizes = [0, 0, 0] # samples in the window held in low (1) and high (2)
+
+    def top(heap):
+        while heap and side[heap[0][1]] == 0:
+            heapq.heappop(heap)
+        return heap[0]
+
+    added = removed = 0
+    for i in range(len(values)):
+        for j in range(added, ends[i]):
+            v = values[j]
+            if v != v:
+                continue
+            if sizes[1] == 0 or v <= -top(low)[0]:
+                heapq.heappush(low, (-v, j))
+                side[j] = 1
+            else:
+                heapq.heappush(high, (v, j))
+                side[j] = 2
+            sizes[side[j]] += 1
+        added = max(added, ends[i])
+        for j in range(removed, starts[i]):
+            sizes[side[j]] -= 1
+            side[j] = 0
+        removed = max(removed, starts[i])
+        while sizes[1] > sizes[2] + 1:
+            top(low)
+            v, j = heapq.heappop(low)
+            heapq.heappush(high, (-v, j))
+            side[j] = 2
+            sizes[1] -= 1
+            sizes[2] += 1
+        while sizes[1] < sizes[2]:
+            top(high)
+            v, j = heapq.heappop(high)
+            heapq.heappush(low, (-v, j))
+            side[j] = 1
+            sizes[2] -= 1
+            sizes[1] += 1
+        if sizes[1] > sizes[2]:
+            output[i] = -top(low)[0]
+        elif sizes[1]:
+            output[i] = (top(high)[0] - top(low)[0]) / 2
+    return output
+
+def _extreme(times, values, window, center, keep):
+    """ The minimum (keep is float.__lt__) or maximum (float.__gt__) of each sample's window,
+    from a deque of the positions whose values could still be the extreme, in O(n) """
+    starts, ends = [x.tolist() for x in bounds(times, window, center)]
+    values = np.asarray(values, dtype=float).tolist()
+    output = np.full(len(values), np.nan)
+    candidates = deque()
+    added = 0
+    for i in range(len(values)):
+        for j in range(added, ends[i]):
+            if values[j] == values[j]:
+                while candidates and not keep(values[candidates[-1]], values[j]):
+                    candidates.pop()
+                candidates.append(j)
+        added = max(added, ends[i])
+        while candidates and candidates[0] < starts[i]:
+            candidates.popleft()
+        if candidates:
+            output[i] = values[candidates[0]]
+    return output
+
+def minimum(times, values, window, center = False):
+    return _extreme(times, values, window, center, float.__lt__)
+
+def maximum(times, values, window, center = False):
+    return _extreme(times, values, window, center, float.__gt__)
+
+def ewma(times, values, halflife):
+    """ The exponentially weighted moving average at each sample, in which the weight of
+    earlier samples halves every halflife (in the units of times), so irregular sampling
+    is weighted by elapsed time. nan samples are left out. O(n) """
+    values = np.asarray(values, dtype=float).tolist()
+    decay = np.exp2(-np.diff(np.asarray(times, dtype=float)) / halflife).tolist()
+    output = np.full(len(values), np.nan)
+    total = weight = 0.0
+    for i, v in enumerate(values):
+        if i:
+            total *= decay[i-1]
+            weight *= decay[i-1]
+        if v == v:
+            total += v
+            weight += 1
+        if weight:
+            output[i] = total / weight
+    return output
+
+STATS = {"mean": mean, "median": median, "min": minimum, "max": maximum}
+
+def trend(times, values, window, stat = "median", center = True):
+    """ The rolling stat ("mean", "median", "min", "max" or "ewma", for which window is
+    the halflife) of the values over the sorted times """
+    if stat == "ewma":
+        return ewma(times, values, window)
+    if stat not in STATS:
+        raise ValueError("unknown rolling statistic " + str(stat))
+    return STATS[stat](times, values, window, center)
+
+def benchmark(num_points = 100000, window = 3600):
+    """ Prints the time taken by each statistic over a random walk sampled about every 2
+    minutes, checked against pandas' rolling windows """
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    times = np.cumsum(rng.integers(60, 180, num_points))
+    values = np.cumsum(rng.normal(size=num_points))
+    values[rng.random(num_points) < 0.01] = np.nan
+    rolled = pd.Series(values, index=pd.to_datetime(times, unit="s")).rolling("%ds" % window)
+    for name, expected in [("mean", rolled.mean()), ("median", rolled.median()), ("min", rolled.min()), ("max", rolled.max())]:
+        start = time.perf_counter()
+        result = STATS[name](times, values, window)
+        elapsed = time.perf_counter() - start
+        assert np.allclose(result, expected.to_numpy(), equal_nan=True)
+        print("%s: %.3f s" % (name, elapsed))
+    start = time.perf_counter()
+    ewma(times, values, window)
+    print("ewma: %.3f s" % (time.perf_counter() - start))
@@ -0,0 +1,84 @@
+###
+# Background corrected concentration ratios for the controlled experiments. Every sensor
+# is resampled once onto a grid of times through each round (one minute apart by
+# default), giving a (sensors x rounds x grid) array. The reference (background) sensor
+# is subtracted from every sensor and the result divided by that of the source sensor
+# in one array operation, so each (sensor, round) ratio curve comes out together
+###
+
+import numpy as np
+import pandas as pd
+import timegrid
+
+STEP = 60 # seconds between grid times
+TOLERANCE = 120 # samples up to 2 * TOLERANCE seconds apart are interpolated between
+
+def round_grid(starts, ends, step = STEP):
+    """ Returns the offsets (seconds from the round start) shared by every round and the
+    (rounds x offsets) epoch second grid. Grid times at or after a round's end are nan """
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    offsets = np.arange(0, np.max(ends - starts), step, dtype=float)
+    grid = starts[:, None] + offsets[None, :]
+    grid[grid >= ends[:, None]] = np.nan
+    return offsets, grid
+
+def resample_rounds(times, vals, grid, tolerance = TOLERANCE):
+    """ Returns the signal (times, vals) linearly interpolated at every time in the grid
+    array (nan where the grid is nan or the samples around it are too far apart) """
+    flat = grid.ravel()
+    inside = ~np.isnan(flat)
+    output = np.full(flat.shape, np.nan)
+    output[inside] = timegrid.resample(flat[inside], times, vals, "linear", tolerance)
+    return output.reshape(grid.shape)
+
+def corrected_ratios(values, source, reference):
+    """ Returns (values - values[reference]) / (values[source] - values[reference]) for a
+    (sensors x ...) array, where source and reference are sensor indices """
+    corrected = values - values[reference]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return corrected / corrected[source]
+
+class RoundRatios:
+    """ The resampled values and background corrected ratios of labelled sensors over
+    numbered rounds. values and ratios are (sensors x rounds x offsets) arrays """
+
+    def __init__(self, labels, rounds, offsets, values, source, reference):
+        self.labels = list(labels)
+        self.rounds = list(rounds)
+        self.offsets = np.asarray(offsets, dtype=float)
+        self.values = np.asarray(values, dtype=float)
+        self.source = source
+        self.reference = reference
+        self.ratios = corrected_ratios(self.values, self.labels.index(source), self.labels.index(reference))
+
+    @classmethod
+    def from_series(cls, series, windows, source, reference, step = STEP, tolerance = TOLERANCE):
+        """ series maps each sensor label to its SensorSeries and windows maps each round
+        number to its (start, end) epoch seconds """
+        rounds = sorted(windows)
+        offsets, grid = round_grid([windows[n][0] for n in rounds], [windows[n][1] for n in rounds], step)
+        values = np.stack([resample_rounds(x.epoch, x.values, grid, tolerance) for x in series.values()])
+        return cls(series.keys(), rounds, offsets, values, source, reference)
+
+    def curve(self, label, number):
+        """ Returns the minutes since the start of round number and the ratios of the
+        labelled sensor in that round """
+        return self.offsets / 60, self.ratios[self.labels.index(label), self.rounds.index(number)]
+
+    def save(self, path):
+        np.savez(path, labels=np.array(self.labels, dtype=str), rounds=np.array(self.rounds), offsets=self.offsets,
+                 values=self.values, source=self.source, reference=self.reference)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as archive:
+            return cls(archive["labels"].tolist(), archive["rounds"].tolist(), archive["offsets"], archive["values"],
+                       str(archive["source"]), str(archive["reference"]))
+
+    def to_csv(self, path):
+        """ Writes one row per sensor, round and grid time with its value and ratio """
+        i, j, k = np.indices(self.values.shape).reshape(3, -1)
+        pd.DataFrame({"sensor": np.array(self.labels)[i], "round": np.array(self.rounds)[j],
+                      "minutes": self.offsets[k] / 60, "value": self.values.ravel(),
+                      "ratio": self.ratios.ravel()}).to_csv(path, index=False)
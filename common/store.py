@@ -0,0 +1,258 @@
+###
+# Local SQLite store for the samples of every sensor source (PurpleAir SD card logs and
+# website downloads, AQY exports, the particle counter log). Each sample is a row keyed
+# by (sensor_id, channel, epoch seconds, seq) in a WITHOUT ROWID table, so the rows of
+# one sensor channel are stored together in time order and a time range is read with
+# one index seek. seq numbers the samples a csv logs at the same second (the counter
+# sometimes logs two), so none of them is lost. Every parameter has its own REAL column, added when it is first ingested.
+# The params table maps parameter names to their columns (p1, p2, ...), since SQLite
+# column names ignore case and sources name their parameters e.g. "adc" and "ADC".
+# Each script provides an ingest(db) function normalizing its csvs into the store, and
+#     python common/store.py ingest
+# runs all of them. Ingest is incremental: the files table is a manifest of every csv
+# ingested with its size, modification time and hash, and only new or changed files are
+# parsed again. Readers ingest what is new for their source, then query the store; if
+# there is no store they fall back to the csvs
+###
+
+import os
+import sys
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+import timeparse
+import csvcache
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DEFAULT_PATH = os.path.join(ROOT, "sensors.db")
+
+# Script directory and module of every source's ingest function
+SOURCES = [("PurpleAir_Analysis", "purple_data"), ("PurpleAir_Analysis", "background_sensors"),
+           ("AQY_Uploaded", "aqy"), ("AQY_Analysis", "exp"), ("ParticleCounter_Animation", "animation")]
+
+KEY_COLUMNS = ["sensor_id", "channel", "epoch", "seq"]
+
+# Kept in the database's user_version. Stores of an older layout are emptied and
+# ingested again from the csvs
+SCHEMA_VERSION = 2
+
+# Channel of the sources that only have one (AQY, particle counter)
+MAIN_CHANNEL = "main"
+
+# Number of queries run so far, for benchmarking (see csvcache.READS)
+QUERIES = {"query": 0}
+
+def manifest_path(path):
+    """ The path as recorded in the manifest, relative to the repository """
+    return os.path.relpath(os.path.abspath(path), ROOT)
+
+def file_hash(path):
+    """ The sha1 hex digest of the file's contents """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_csv(path, time_column, time_format = None, tz = "UTC", skiprows = 0, exclude = ()):
+    """ Returns the epoch seconds of the csv's time column and a dict of its numeric
+    columns as float arrays. Columns with no numeric value (ids, text, the empty column
+    left by a trailing comma) and the exclude columns are left out, as are rows whose
+    time cannot be parsed """
+    df = csvcache.read_csv(path, skiprows=skiprows, dtype=str)
+    epoch, valid = timeparse.parse_epoch(df[time_column], time_format, tz)
+    numeric = {name: pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=float)
+               for name in df.columns if name != time_column and name not in exclude}
+    if not valid.all():
+        # only rows holding values are worth a mention, not blank or event log lines
+        lost = np.count_nonzero(~valid & np.any([~np.isnan(vals) for vals in numeric.values()], axis=0))
+        if lost:
+            print("%s: left out %d of %d rows with values but no valid time" % (manifest_path(path), lost, len(valid)))
+        epoch = epoch[valid]
+        numeric = {name: vals[valid] for name, vals in numeric.items()}
+    columns = {name: vals for name, vals in numeric.items() if not np.isnan(vals).all()}
+    return epoch, columns
+
+def sequence(epoch):
+    """ Numbers the samples at each second in the order they come: 0 for the first
+    sample at its time, 1 for the next at the same time, and so on """
+    order = np.argsort(epoch, kind="stable")
+    ordered = epoch[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    counts = np.diff(np.r_[starts, len(ordered)])
+    seq = np.empty(len(epoch), dtype=np.int64)
+    seq[order] = np.arange(len(epoch)) - np.repeat(starts, counts)
+    return seq
+
+class Store:
+    """ The sensor database at path, created if needed. Each thread gets its own
+    connection, so a Store can be shared by the background loading threads """
+
+    def __init__(self, path = DEFAULT_PATH):
+        self.path = path
+        self._local = threading.local()
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version < SCHEMA_VERSION:
+            with self.connection as db:
+                for table in ["samples", "params", "files"]:
+                    db.execute("DROP TABLE IF EXISTS " + table)
+                db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS samples (sensor_id TEXT NOT NULL, channel TEXT NOT NULL, "
+                                "epoch INTEGER NOT NULL, seq INTEGER NOT NULL, "
+                                "PRIMARY KEY (sensor_id, channel, epoch, seq)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS params (name TEXT PRIMARY KEY, column_name TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                                "mtime_ns INTEGER NOT NULL, sha1 TEXT NOT NULL)")
+
+    @property
+    def connection(self):
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = sqlite3.connect(self.path)
+        return self._local.connection
+
+    def close(self):
+        if getattr(self._local, "connection", None) is not None:
+            self._local.connection.close()
+            self._local.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def columns(self):
+        """ Maps the name of every parameter in the store to its column """
+        return dict(self.connection.execute("SELECT name, column_name FROM params").fetchall())
+
+    def sensors(self):
+        """ The (sensor_id, channel) pairs in the store """
+        return self.connection.execute("SELECT DISTINCT sensor_id, channel FROM samples").fetchall()
+
+    def has(self, sensor_id, channel):
+        return self.connection.execute("SELECT 1 FROM samples WHERE sensor_id = ? AND channel = ? LIMIT 1",
+                                       (sensor_id, channel)).fetchone() is not None
+
+    def changed(self, path):
+        """ Whether the file at path is new or has changed since it was recorded. Files
+        whose size and modification time match the manifest are not read; otherwise the
+        hash of their contents decides (a file that was only touched is re-stamped) """
+        stat = os.stat(path)
+        row = self.connection.execute("SELECT size, mtime_ns, sha1 FROM files WHERE path = ?", (manifest_path(path),)).fetchone()
+        if row is None:
+            return True
+        if row[:2] == (stat.st_size, stat.st_mtime_ns):
+            return False
+        if row[2] != file_hash(path):
+            return True
+        self.record(path)
+        return False
+
+    def record(self, path):
+        """ Adds the file at path to the manifest with its current size, modification time
+        and hash """
+        stat = os.stat(path)
+        with self.connection as db:
+            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                       (manifest_path(path), stat.st_size, stat.st_mtime_ns, file_hash(path)))
+
+    def insert(self, sensor_id, channel, epoch, columns):
+        """ Adds the samples at the epoch seconds, with columns mapping parameter names to
+        value arrays. Samples at the same second are numbered in the order given (seq). A
+        sample already stored at the same time and seq is updated, keeping its values for
+        parameters that are nan here """
+        names = list(columns)
+        known = self.columns()
+        with self.connection as db:
+            for name in names:
+                if name not in known:
+                    known[name] = "p%d" % (len(known) + 1)
+                    db.execute("ALTER TABLE samples ADD COLUMN %s REAL" % known[name])
+                    db.execute("INSERT INTO params VALUES (?, ?)", (name, known[name]))
+            if len(epoch) == 0:
+                return
+            epoch = np.asarray(epoch, dtype=np.int64)
+            values = [np.where(np.isnan(columns[name]), None, columns[name]).tolist() for name in names]
+            rows = zip([sensor_id] * len(epoch), [channel] * len(epoch), epoch.tolist(), sequence(epoch).tolist(), *values)
+            cols = [known[name] for name in names]
+            update = ", ".join("%s = COALESCE(excluded.%s, %s)" % (col, col, col) for col in cols) or None
+            sql = "INSERT INTO samples (%s) VALUES (%s)" % (", ".join(KEY_COLUMNS + cols), ", ".join("?" * (len(KEY_COLUMNS) + len(names))))
+            sql += " ON CONFLICT (%s) " % ", ".join(KEY_COLUMNS) + ("DO UPDATE SET " + update if update else "DO NOTHING")
+            db.executemany(sql, rows)
+
+    def delete(self, sensor_id, channel = None):
+        """ Removes the samples of the sensor (or of one of its channels) """
+        with self.connection as db:
+            if channel is None:
+                db.execute("DELETE FROM samples WHERE sensor_id = ?", (sensor_id,))
+            else:
+                db.execute("DELETE FROM samples WHERE sensor_id = ? AND channel = ?", (sensor_id, channel))
+
+    def query(self, sensor_id, channel, params, start = None, end = None, dropna = True):
+        """ Returns a dict mapping "epoch" (int64 seconds) and each of params to an array
+        (nan where a value is missing) for the sensor channel's samples from start to end
+        epoch seconds inclusive, in time order. With dropna, samples missing every one of
+        params are left out. Raises KeyError if a parameter is not in the store """
+        params = list(params)
+        known = self.columns()
+        absent = [name for name in params if name not in known]
+        if absent:
+            raise KeyError(str(absent) + " not in " + self.path)
+        cols = [known[name] for name in params]
+        sql = "SELECT epoch%s FROM samples WHERE sensor_id = ? AND channel = ?" % "".join(", " + col for col in cols)
+        args = [sensor_id, channel]
+        if start is not None:
+            sql += " AND epoch >= ?"
+            args.append(int(start))
+        if end is not None:
+            sql += " AND epoch <= ?"
+            args.append(int(end))
+        if dropna and params:
+            sql += " AND (" + " OR ".join(col + " IS NOT NULL" for col in cols) + ")"
+        QUERIES["query"] += 1
+        rows = self.connection.execute(sql + " ORDER BY epoch, seq", args).fetchall()
+        table = np.array(rows, dtype=float).reshape(len(rows), len(params) + 1)
+        output = {"epoch": table[:, 0].astype(np.int64)}
+        for i, name in enumerate(params):
+            output[name] = table[:, i+1]
+        return output
+
+def ingest_files(db, paths, ingest_file):
+    """ Calls ingest_file(db, path) for each of the paths that is new or has changed since
+    it was last ingested (see Store.changed), recording it in the manifest afterwards. A
+    file whose ingest fails is not recorded, so it is ingested again next time; as rows
+    are upserted this is harmless. Returns the paths ingested """
+    done = []
+    for path in paths:
+        if db.changed(path):
+            ingest_file(db, path)
+            db.record(path)
+            done.append(path)
+    return done
+
+_stores = {}
+
+def default(path = DEFAULT_PATH):
+    """ The Store at path if it has been ingested, otherwise None, in which case readers
+    parse the csvs themselves """
+    if path not in _stores:
+        _stores[path] = Store(path) if os.path.exists(path) else None
+    return _stores[path]
+
+def ingest(path = DEFAULT_PATH):
+    """ Runs the ingest function of every source in SOURCES into the store at path,
+    which only parses the files that are new or changed since the last run """
+    with Store(path) as db:
+        for directory, module in SOURCES:
+            sys.path.append(os.path.join(ROOT, directory))
+            done = __import__(module).ingest(db)
+            print("%s: ingested %d new or changed files" % (module, len(done)))
+    _stores.pop(path, None)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "ingest":
+        ingest(*sys.argv[2:3])
+    else:
+        print("usage: python store.py ingest [database path]")
@@ -0,0 +1,159 @@
+###
+# Live view of sensor csvs that are still being written. Each file is followed from a
+# byte offset: a poll checks the file size, and only the complete lines appended since
+# the last poll are read and parsed, into fixed size ring buffers of the most recent
+# samples. The plot is redrawn at a fixed rate with blitting: the axes are drawn once and
+# each update restores them and draws only the lines, so following several files at 1 Hz
+# costs next to no CPU. The axes are only redrawn when the data outgrow them
+###
+
+import csv
+import io
+import os
+import time
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import sensorseries
+import timeparse
+
+CAPACITY = 3600 # samples kept per parameter, an hour of 1 Hz data
+
+class RingBuffer:
+    """ The last capacity samples appended, as epoch seconds and values held in arrays
+    allocated once """
+
+    def __init__(self, capacity = CAPACITY):
+        self.epoch = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full(capacity, np.nan)
+        self.total = 0 # samples written so far
+
+    def __len__(self):
+        return min(self.total, len(self.epoch))
+
+    def extend(self, epoch, values):
+        """ Appends the samples, overwriting the oldest once the buffer is full """
+        epoch = np.asarray(epoch, dtype=np.int64)[-len(self.epoch):]
+        values = np.asarray(values, dtype=float)[-len(self.epoch):]
+        pos = (self.total + np.arange(len(epoch))) % len(self.epoch)
+        self.epoch[pos] = epoch
+        self.values[pos] = values
+        self.total += len(epoch)
+
+    def series(self, sensor = None, channel = None):
+        """ The buffered samples as a SensorSeries, oldest first """
+        if self.total <= len(self.epoch):
+            return sensorseries.SensorSeries(self.epoch[:self.total], self.values[:self.total], sensor, channel)
+        split = self.total % len(self.epoch)
+        return sensorseries.SensorSeries(np.concatenate([self.epoch[split:], self.epoch[:split]]),
+                                         np.concatenate([self.values[split:], self.values[:split]]), sensor, channel)
+
+class CsvTail:
+    """ Follows the csv at path as lines are appended to it. parse_times takes a DataFrame
+    of new rows (all columns as strings) and returns their epoch seconds, timeparse.NAT
+    for times that cannot be parsed, whose rows are skipped, as are rows with more
+    fields than the header. The header is on line skiprows. The values of each of params
+    go to its RingBuffer in buffers """
+
+    def __init__(self, path, params, parse_times, skiprows = 0, capacity = CAPACITY):
+        self.path = path
+        self.params = list(params)
+        self.parse_times = parse_times
+        self.skiprows = skiprows
+        self.buffers = {param: RingBuffer(capacity) for param in self.params}
+        self.header = None
+        self.offset = 0 # where the first line not yet parsed starts
+
+    def poll(self):
+        """ Parses the complete lines appended since the last poll into the buffers and
+        returns how many there were. A line still being written is left for the next
+        poll. If the file shrinks it is followed again from its header """
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+        if size < self.offset:
+            self.header = None
+        if self.header is not None and size == self.offset:
+            return 0
+        with open(self.path, "rb") as f:
+            if self.header is None:
+                lines = [f.readline() for _ in range(self.skiprows + 1)]
+                if not lines[-1].endswith(b"\n"):
+                    return 0
+                self.header = lines[-1].decode("utf-8-sig").strip().split(",")
+                self.offset = f.tell()
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return 0
+        self.offset += end
+        # lines with more fields than the header (two lines merged by the logger) are
+        # skipped, which pandas would instead cut short; shorter ones are kept, as logs
+        # often leave off trailing empty fields
+        lines = data[:end].decode("utf-8", errors="replace").splitlines(keepends=True)
+        lines = [line for line, row in zip(lines, csv.reader(lines)) if len(row) <= len(self.header)]
+        if not lines:
+            return 0
+        df = pd.read_csv(io.StringIO("".join(lines)), names=self.header, header=None, dtype=str, index_col=False)
+        df = df[df[self.header[0]] != self.header[0]] # headers repeated in joined logs
+        if len(df) == 0:
+            return 0
+        epoch = np.asarray(self.parse_times(df))
+        valid = epoch != timeparse.NAT
+        df, epoch = df[valid], epoch[valid]
+        for param in self.params:
+            self.buffers[param].extend(epoch, pd.to_numeric(df[param], errors="coerce").to_numpy(dtype=float))
+        return len(df)
+
+def live_plot(tails, interval = 1.0, duration = None, labels = None):
+    """ Plots the buffered values of every parameter of each CsvTail against the minutes
+    since the first sample, polling the files and redrawing every interval seconds until
+    the window is closed (or for duration seconds). The lines are blitted over a saved
+    background, which is only redrawn when the axes are rescaled. Prints and returns the
+    CPU seconds used per second """
+    fig, ax = plt.subplots()
+    keys = [(tail, param) for tail in tails for param in tail.params]
+    lines = [ax.plot([], [], animated=True)[0] for _ in keys]
+    ax.legend(lines, labels or [os.path.basename(tail.path) + " " + param for tail, param in keys], loc="upper left")
+    ax.set_xlabel("Time [mins]")
+    plt.show(block=False)
+    canvas = fig.canvas
+    canvas.draw()
+    background = canvas.copy_from_bbox(ax.bbox)
+    origin = None
+    wallStart, cpuStart = time.perf_counter(), time.process_time()
+    tick = wallStart
+    while plt.fignum_exists(fig.number) and (duration is None or tick - wallStart < duration):
+        if sum(tail.poll() for tail in tails):
+            data = [tail.buffers[param].series() for tail, param in keys]
+            if origin is None:
+                origin = min(x.epoch[0] for x in data if len(x))
+            xs = [x.minutes(origin) for x in data]
+            low = min(x[0] for x in xs if len(x))
+            high = max(x[-1] for x in xs if len(x))
+            finite = [x.values[np.isfinite(x.values)] for x in data]
+            bottom = min([x.min() for x in finite if len(x)], default=0)
+            top = max([x.max() for x in finite if len(x)], default=1)
+            for line, x, y in zip(lines, xs, data):
+                line.set_data(x, y.values)
+            (left, right), (lower, upper) = ax.get_xlim(), ax.get_ylim()
+            if low < left or high > right or bottom < lower or top > upper:
+                # leave a quarter of the span free so rescaling (a full redraw) is rare
+                span = max(high - low, 1)
+                ax.set_xlim(low, high + span / 4)
+                margin = max(top - bottom, 1) / 4
+                ax.set_ylim(bottom - margin, top + margin)
+                canvas.draw()
+                background = canvas.copy_from_bbox(ax.bbox)
+            canvas.restore_region(background)
+            for line in lines:
+                ax.draw_artist(line)
+            canvas.blit(ax.bbox)
+        canvas.flush_events()
+        tick += interval
+        time.sleep(max(tick - time.perf_counter(), 0))
+    rate = (time.process_time() - cpuStart) / (time.perf_counter() - wallStart)
+    print("used %.3f CPU seconds per second" % rate)
+    return rate
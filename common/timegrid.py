@@ -0,0 +1,74 @@
+###
+# Helpers for putting sensor signals sampled at different times onto a common time
+# grid. Times are epoch seconds (see timeparse.py). Each signal is matched against the
+# grid with a binary search (np.searchsorted), so aligning n samples costs O(n log n)
+# and no sample is paired with one taken at a different time
+###
+
+import numpy as np
+
+STEP = 120 # seconds between PurpleAir samples
+TOLERANCE = 90 # furthest a sample can be from a grid time and still be used, in seconds
+
+def common_grid(times, step = STEP):
+    """ Returns a regular grid of epoch seconds, step seconds apart, spanning the period
+    covered by every one of the time arrays in times """
+    start = max(np.min(x) for x in times)
+    end = min(np.max(x) for x in times)
+    return np.arange(start, end + 1, step, dtype=np.int64)
+
+def resample(grid, times, vals, method = "nearest", tolerance = TOLERANCE):
+    """ Returns the values of the signal (times, vals) at each of the grid times as a float
+    array. "nearest" takes the closest sample, which must be within tolerance seconds.
+    "linear" interpolates between the samples either side, which must be at most
+    2 * tolerance seconds apart. Grid times that cannot be filled are nan """
+    grid = np.asarray(grid)
+    times = np.asarray(times)
+    vals = np.asarray(vals, dtype=float)
+    if np.any(times[1:] < times[:-1]):
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+        vals = vals[order]
+    output = np.full(len(grid), np.nan)
+    if len(times) == 0:
+        return output
+    right = np.clip(np.searchsorted(times, grid), 0, len(times)-1)
+    left = np.clip(right-1, 0, len(times)-1)
+    leftGap = np.abs(grid - times[left])
+    rightGap = np.abs(times[right] - grid)
+    if method == "nearest":
+        index = np.where(leftGap <= rightGap, left, right)
+        valid = np.minimum(leftGap, rightGap) <= tolerance
+        output[valid] = vals[index[valid]]
+    elif method == "linear":
+        span = (times[right] - times[left]).astype(float)
+        weight = np.divide(grid - times[left], span, out=np.zeros(len(grid)), where=span > 0)
+        valid = (span <= 2 * tolerance) & (times[left] <= grid) & (grid <= times[right])
+        valid |= rightGap == 0
+        interp = vals[left] + weight * (vals[right] - vals[left])
+        interp = np.where(rightGap == 0, vals[right], interp) # exact hits don't depend on the sample before
+        output[valid] = interp[valid]
+    else:
+        raise ValueError("method must be nearest or linear, not " + str(method))
+    return output
+
+def window_slices(times, starts, ends):
+    """ Returns a slice of the sorted times for each window, covering the times strictly
+    between its start and end. Windows may overlap and be in any order, and a time in
+    several windows is in each of their slices, so indexing with them gives views """
+    times = np.asarray(times)
+    lefts = np.searchsorted(times, starts, side="right")
+    rights = np.maximum(np.searchsorted(times, ends, side="left"), lefts)
+    return [slice(left, right) for left, right in zip(lefts.tolist(), rights.tolist())]
+
+def nearest_slice(times, start, end):
+    """ Returns the slice of the sorted times running from the time nearest start to the
+    time nearest end, both included (the earlier time on a tie) """
+    times = np.asarray(times)
+    if len(times) == 0:
+        return slice(0, 0)
+    targets = np.array([start, end])
+    right = np.clip(np.searchsorted(times, targets), 0, len(times)-1)
+    left = np.maximum(right-1, 0)
+    nearest = np.where(np.abs(times[left] - targets) <= np.abs(times[right] - targets), left, right)
+    return slice(int(nearest[0]), max(int(nearest[1]), int(nearest[0]-1)) + 1)
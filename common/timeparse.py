@@ -0,0 +1,111 @@
+###
+# Vectorized helpers for turning the timestamp columns of the sensor csvs into typed
+# arrays. Times are held as int64 seconds since the unix epoch (UTC) so whole columns
+# can be converted, compared and split into days without looping in Python. Local
+# times are computed with the US/Pacific time zone, so daylight saving is handled
+# instead of assuming a fixed UTC-7 offset
+###
+
+import numpy as np
+import pandas as pd
+
+LOCAL_TZ = "US/Pacific"
+
+SD_CARD_FORMAT = "%Y/%m/%dT%H:%M:%Sz" # UTCDateTime column of PurpleAir SD card logs
+WEBSITE_FORMAT = "%Y-%m-%d %H:%M:%S UTC" # created_at column of PurpleAir website downloads
+
+# Fixed width formats that are rewritten as ISO 8601 before parsing, which pandas
+# handles far faster than a strptime format with literal characters in it
+ISO_REWRITES = {SD_CARD_FORMAT: ("/", "-"), WEBSITE_FORMAT: ("-", "-")}
+
+JUNK_CHARS = "".join(chr(i) for i in range(32)) + "\ufeff"
+
+# Epoch seconds given to times that cannot be parsed (numpy's NaT as an int64)
+NAT = np.iinfo(np.int64).min
+
+def parse_epoch(times, fmt = None, tz = "UTC"):
+    """ Converts a column of time strings to int64 seconds since the epoch. times are
+    interpreted in the time zone tz. Control characters left by the SD card logger are
+    ignored. Returns the epoch seconds and a boolean array of the entries that could be
+    parsed; the others (e.g. missing times, or lines merged by the logger) are NAT and
+    are for the caller to drop """
+    parsed = pd.Series(times)
+    if not pd.api.types.is_datetime64_any_dtype(parsed):
+        if not pd.api.types.is_string_dtype(parsed):
+            parsed = parsed.astype(str)
+        parsed = parsed.str.strip(JUNK_CHARS)
+        if fmt in ISO_REWRITES:
+            old, new = ISO_REWRITES[fmt]
+            parsed = parsed.str.slice(0, 19).str.replace(old, new, regex=False)
+            fmt = "ISO8601"
+        parsed = pd.to_datetime(parsed, format=fmt, errors="coerce")
+    if parsed.dt.tz is None:
+        parsed = localize(parsed, tz)
+    epoch = parsed.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy("datetime64[s]").astype(np.int64)
+    return epoch, epoch != NAT
+
+def localize(naive, tz):
+    """ Localizes a Series of naive times to tz. Times skipped when the clocks go forward
+    are moved forward. Times in the hour repeated when the clocks go back are taken as
+    summer time until the wall clock goes back within that hour, as it does in logs kept
+    in local time, and as standard time after it """
+    local = naive.dt.tz_localize(tz, ambiguous="NaT", nonexistent="shift_forward")
+    ambiguous = (local.isna() & naive.notna()).to_numpy()
+    if not ambiguous.any():
+        return local
+    wall = naive[ambiguous].to_numpy().astype(np.int64)
+    latest = np.maximum.accumulate(wall) # latest ambiguous wall time so far
+    back = np.cumsum(wall < np.r_[wall[0], latest[:-1]]) # times the wall clock went back
+    day = wall // (86400 * 10**9)
+    start = np.r_[0, np.flatnonzero(np.diff(day)) + 1] # first time of each repeated hour
+    summer = np.ones(len(naive), dtype=bool)
+    summer[ambiguous] = back == np.repeat(back[start], np.diff(np.r_[start, len(wall)]))
+    return naive.dt.tz_localize(tz, ambiguous=summer, nonexistent="shift_forward")
+
+def to_epoch(times, fmt = None, tz = "UTC"):
+    """ parse_epoch for times that must all be valid. Raises ValueError naming the first
+    time that cannot be parsed """
+    epoch, valid = parse_epoch(times, fmt, tz)
+    if not valid.all():
+        bad = np.flatnonzero(~valid)
+        raise ValueError("%d of %d times could not be parsed, the first being %r" % (len(bad), len(valid), list(times)[bad[0]]))
+    return epoch
+
+def local_times(epoch, tz = LOCAL_TZ):
+    """ Returns the epoch seconds as a time zone aware pandas DatetimeIndex """
+    return pd.DatetimeIndex(np.asarray(epoch, dtype="datetime64[s]"), tz="UTC").tz_convert(tz)
+
+def local_day_hours(epoch, tz = LOCAL_TZ):
+    """ Returns the local day of the month and the fractional local hour (to the minute)
+    for each of the epoch seconds """
+    local = local_times(epoch, tz)
+    days = local.day.to_numpy()
+    hours = local.hour.to_numpy() + local.minute.to_numpy() / 60
+    return days, hours
+
+def local_dates(epoch, tz = LOCAL_TZ):
+    """ Returns the local calendar date (numpy datetime64[D]) of each of the epoch seconds """
+    return local_times(epoch, tz).tz_localize(None).to_numpy().astype("datetime64[D]")
+
+def split_days(days):
+    """ Maps each distinct day to the positions holding it. Positions are slices when
+    the days are contiguous (chronological data) so indexing with them gives views """
+    days = np.asarray(days)
+    if len(days) == 0:
+        return {}
+    if np.all(days[1:] >= days[:-1]):
+        order = None
+        sortedDays = days
+    else:
+        order = np.argsort(days, kind="stable")
+        sortedDays = days[order]
+    uniqueDays, starts = np.unique(sortedDays, return_index=True)
+    ends = np.append(starts[1:], len(sortedDays))
+    output = {}
+    for day, start, end in zip(uniqueDays.tolist(), starts, ends):
+        output[day] = slice(start, end) if order is None else order[start:end]
+    return output
+
+def relative_hours(epoch, tz = LOCAL_TZ):
+    """ Returns the fractional local hour of the day for each of the epoch seconds """
+    return local_day_hours(epoch, tz)[1]
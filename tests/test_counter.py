@@ -0,0 +1,79 @@
+###
+# Checks of the particle counter log reader in ParticleCounter_Animation/animation.py
+# against a linear scan of the lines and strptime, on a small log written for the test
+###
+
+import os
+import sys
+import mmap
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from pytz import timezone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ParticleCounter_Animation"))
+import animation
+
+HEADER = "\ufeff#YY/MM/DD,HR:MN:SC,concent,cnt_sec\n"
+
+def clocks(start = "15:00:00", num_lines = 40):
+    """ HR:MN:SC times a second apart, with a repeated second and a skipped one like the
+    real log """
+    first = datetime.strptime(start, "%H:%M:%S")
+    times = [(first + timedelta(seconds=i)).strftime("%H:%M:%S") for i in range(num_lines)]
+    return times[:10] + [times[10]] + times[10:20] + times[21:]
+
+def write_log(path, times, day = "19/11/22"):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(HEADER)
+        for i, clock in enumerate(times):
+            f.write("%s,%s,%d,%d\n" % (day, clock, 1000 + i, i))
+    return path
+
+def scan_lines(mm, key, after = False):
+    """ animation.bisect_lines by reading the lines one by one """
+    pos = mm.find(b"\n") + 1
+    while pos < len(mm):
+        line = animation.line_key(mm, pos)
+        if (line > key) if after else (line >= key):
+            return pos
+        pos = mm.find(b"\n", pos) + 1 or len(mm)
+    return len(mm)
+
+def seconds(clock):
+    h, m, s = map(int, clock.split(":"))
+    return h * 3600 + m * 60 + s
+
+def test_bisect_matches_scan(tmp_path):
+    times = clocks()
+    path = write_log(str(tmp_path / "counter.csv"), times)
+    # before the first line, on the first, repeated and last lines, between and past them
+    keys = ["14:59:59", times[0], times[10], "15:00:21", times[-1], "15:01:00"]
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        body = mm.find(b"\n") + 1
+        for clock in keys:
+            key = b"19/11/22" + clock.encode()
+            for after in [False, True]:
+                assert animation.bisect_lines(mm, key, body, len(mm), after) == scan_lines(mm, key, after)
+
+def test_counter_epoch_matches_strptime():
+    dates = ["19/11/22", "19/11/22", "20/03/08", "20/02/29"]
+    times = ["15:17:28", "00:00:00", "12:30:05", "23:59:59"]
+    pacific = timezone("US/Pacific")
+    expected = [pacific.localize(datetime.strptime(d + " " + t, "%y/%m/%d %H:%M:%S")).timestamp() for d, t in zip(dates, times)]
+    assert animation.counter_epoch(dates, times).tolist() == expected
+    # a malformed field sends the whole column through the string parser
+    assert animation.counter_epoch(dates + ["19/11/2"], times + ["15:17:28"])[:4].tolist() == expected
+
+@pytest.mark.parametrize("start, end", [(None, None), ("14:00:00", "16:00:00"), ("15:00:00", "15:00:38"),
+                                        ("15:00:10", "15:00:20"), ("15:00:38", "15:00:38")])
+def test_read_counter_matches_scan(tmp_path, start, end):
+    times = clocks()
+    path = write_log(str(tmp_path / "counter.csv"), times)
+    data = animation.read_counter(["concent"], start, end, path, chunksize=7)
+    # every sample from the one nearest start to the one nearest end, repeats included
+    first = times.index(min(times, key=lambda t: abs(seconds(t) - seconds(start or times[0]))))
+    last = len(times) - 1 - times[::-1].index(min(times, key=lambda t: abs(seconds(t) - seconds(end or times[-1]))))
+    assert data[animation.CLOCK_COLUMN].tolist() == times[first:last+1]
+    assert data["concent"].tolist() == list(range(1000 + first, 1000 + last + 1))
+    assert np.all(np.diff(data["time"]) >= 0)
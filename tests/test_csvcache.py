@@ -0,0 +1,51 @@
+###
+# Checks of the merged line handling in common/csvcache.py on small csvs written for
+# the test
+###
+
+import os
+import sys
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import csvcache
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+# a preamble, the header, a merged first line, a quoted line and a short line
+LOG = ("exported\n,\n" + "time,id,pm,gas\n" + "t1,a,t2,a,1.5,\n" + "t3,a,2.5,\n" + 't4,"a,b",3.5,\n' +
+       "t5,a,4.5\n" + "t6,a,t7,a,5.5,\n" + "t8,a,6.5,")
+
+@pytest.mark.parametrize("block", [1, 7, csvcache.BLOCK_BYTES])
+def test_merged_lines(tmp_path, block):
+    path = write(str(tmp_path / "log.csv"), LOG)
+    assert csvcache.merged_lines(path, 2, block) == [3, 7]
+
+def test_read_csv_leaves_out_merged_lines(tmp_path):
+    path = write(str(tmp_path / "log.csv"), LOG)
+    df = csvcache.read_csv(path, ["time", "pm"], 2)
+    assert df["time"].tolist() == ["t3", "t4", "t5", "t8"]
+    assert df["pm"].tolist() == [2.5, 3.5, 4.5, 6.5] # numeric, as if the merged lines were never there
+    chunks = list(csvcache.read_csv(path, ["time", "pm"], 2, chunksize=3))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+
+def test_read_columns_with_merged_first_line(tmp_path):
+    path = write(str(tmp_path / "log.csv"), "time,pm\n" + "2020-01-01 00:00:00,2020-01-01 00:01:00,1\n" +
+                 "2020-01-01 00:02:00,2\n" + "2020-01-01 00:03:00,3\n")
+    cols = csvcache.read_columns(path, ["pm"], "time", "%Y-%m-%d %H:%M:%S")
+    assert cols["pm"].tolist() == [2, 3]
+    assert cols["time"].tolist() == [1577836920, 1577836980]
+
+def test_read_columns_parses_time_again_for_another_format_or_zone(tmp_path):
+    path = write(str(tmp_path / "log.csv"), "time,pm\n" + "2020-01-01 00:00:00,1\n" + "2020-01-01 00:01:00,2\n")
+    utc = csvcache.read_columns(path, ["pm"], "time", "%Y-%m-%d %H:%M:%S")
+    pacific = csvcache.read_columns(path, ["pm"], "time", "%Y-%m-%d %H:%M:%S", "US/Pacific")
+    assert (pacific["time"] - utc["time"]).tolist() == [8 * 3600] * 2
+    # a format that does not fit leaves out every row rather than serving the first parse
+    assert len(csvcache.read_columns(path, ["pm"], "time", "%d/%m/%Y %H:%M")["time"]) == 0
+    reads = dict(csvcache.READS)
+    assert csvcache.read_columns(path, ["pm"], "time", "%Y-%m-%d %H:%M:%S")["time"].tolist() == utc["time"].tolist()
+    assert csvcache.READS["csv"] == reads["csv"] # both parses are kept in the archive
@@ -0,0 +1,46 @@
+###
+# Checks of the saved diurnal profile store in common/diurnal.py and its use by
+# pilotProfiles in PurpleAir_Analysis/purple_data.py
+###
+
+import os
+import sys
+import datetime
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PurpleAir_Analysis"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import purple_data
+import diurnal
+from test_streaming import write_log
+
+def test_save_and_load_keep_dates_and_signal(tmp_path):
+    profiles = diurnal.DailyProfiles(param="pm2_5_atm", option="average")
+    dates = [datetime.date(2019, 10, 10), datetime.date(2019, 11, 10)]
+    profiles.add_day(dates[0], [12.0, 12.5], [1.0, 3.0])
+    profiles.add_day(dates[1], [12.0], [5.0])
+    path = str(tmp_path / "profiles.npz")
+    profiles.save(path)
+    loaded = diurnal.DailyProfiles.load(path)
+    assert loaded.days == dates
+    assert loaded.matches("pm2_5_atm", "average") and not loaded.matches("pm2_5_atm", "NA")
+    assert np.array_equal(loaded.mean(dates), profiles.mean(dates), equal_nan=True)
+
+def test_old_store_matches_nothing(tmp_path):
+    path = str(tmp_path / "profiles.npz")
+    np.savez(path, bin_minutes=2, days=np.array([10, 11]), counts=np.zeros((2, 720)),
+             sums=np.zeros((2, 720)), sumsqs=np.zeros((2, 720)))
+    assert not diurnal.DailyProfiles.load(path).matches("pm2_5_atm", "NA")
+
+def test_pilot_profiles_rebuild_for_another_signal(tmp_path):
+    # the same day of the month in two months, then the store asked for another option
+    log = write_log(str(tmp_path / "log.csv"), [(10, 10), (11, 10)])
+    path = str(tmp_path / "profiles.npz")
+    dates = [datetime.date(2019, 10, 10), datetime.date(2019, 11, 10)]
+    single = purple_data.pilotProfiles("pm2_5_atm", dates, path=path, paths=[log])
+    assert single.days == dates
+    assert np.nanmax(single.mean(dates[:1])) == 1010 and np.nanmax(single.mean(dates[1:])) == 1110
+    averaged = purple_data.pilotProfiles("pm2_5_atm", dates, "average", path=path, paths=[log])
+    assert averaged.matches("pm2_5_atm", "average")
+    assert np.nanmax(averaged.mean(dates[:1])) == 1011
+    assert diurnal.DailyProfiles.load(path).matches("pm2_5_atm", "average")
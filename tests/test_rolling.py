@@ -0,0 +1,96 @@
+###
+# Checks of common/rolling.py against pandas' time-based rolling windows and a brute
+# force scan of every window, on small synthetic series
+###
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import rolling
+
+def brute_force(times, values, window, center, reduce):
+    """ reduce over the finite values of each sample's window, found by scanning every
+    sample: (t - window, t] up to and including the sample itself, or [t - window/2,
+    t + window/2] if center. nan where a window has no finite value """
+    output = np.full(len(values), np.nan)
+    for i, t in enumerate(times):
+        if center:
+            inside = [j for j in range(len(times)) if t - window / 2 <= times[j] <= t + window / 2]
+        else:
+            inside = [j for j in range(i + 1) if times[j] > t - window]
+        finite = [values[j] for j in inside if not np.isnan(values[j])]
+        if finite:
+            output[i] = reduce(finite)
+    return output
+
+REDUCERS = {"mean": np.mean, "median": np.median, "min": np.min, "max": np.max}
+
+def series(seed, num_points = 300, nan_fraction = 0.1):
+    """ Irregular, partly repeated times with a run of nan values and scattered ones """
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.choice([0, 0, 1, 5, 30, 200], num_points))
+    values = rng.normal(size=num_points).round(1) # rounding gives equal values too
+    values[rng.random(num_points) < nan_fraction] = np.nan
+    values[100:130] = np.nan
+    return times, values
+
+@pytest.mark.parametrize("stat", list(REDUCERS))
+@pytest.mark.parametrize("center", [False, True])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_brute_force(stat, center, seed):
+    times, values = series(seed)
+    expected = brute_force(times, values, 60, center, REDUCERS[stat])
+    assert np.allclose(rolling.STATS[stat](times, values, 60, center), expected, equal_nan=True)
+
+@pytest.mark.parametrize("stat", list(REDUCERS))
+def test_matches_pandas(stat):
+    times, values = series(3)
+    rolled = pd.Series(values, index=pd.to_datetime(times, unit="s")).rolling("60s")
+    expected = getattr(rolled, stat)().to_numpy()
+    assert np.allclose(rolling.STATS[stat](times, values, 60), expected, equal_nan=True)
+
+@pytest.mark.parametrize("stat", list(REDUCERS))
+def test_all_nan_windows(stat):
+    times = np.arange(10) * 100
+    values = np.full(10, np.nan)
+    values[[0, 9]] = [1, 2]
+    result = rolling.STATS[stat](times, values, 50)
+    assert result[0] == 1 and result[9] == 2
+    assert np.isnan(result[1:9]).all()
+
+def test_median_repeated_times():
+    # every sample shares its time with others, so whole groups enter and leave at once
+    # and lazily deleted entries pile up at the tops of both heaps
+    times = np.repeat(np.arange(20) * 10, 5)
+    values = np.tile([5.0, 1.0, 4.0, 2.0, 3.0], 20) + np.repeat(np.arange(20), 5)
+    for center in [False, True]:
+        expected = brute_force(times, values, 25, center, np.median)
+        assert np.allclose(rolling.median(times, values, 25, center), expected)
+
+def test_single_sample_windows():
+    times = np.arange(5) * 100
+    values = np.array([3.0, -1.0, np.nan, 7.0, 0.5])
+    for stat in REDUCERS:
+        assert np.allclose(rolling.STATS[stat](times, values, 1), values, equal_nan=True)
+
+def test_ewma_matches_pandas():
+    rng = np.random.default_rng(4)
+    times = np.cumsum(rng.integers(1, 300, 200))
+    values = rng.normal(size=200)
+    expected = pd.Series(values).ewm(halflife=pd.Timedelta(seconds=120), times=pd.to_datetime(times, unit="s")).mean()
+    assert np.allclose(rolling.ewma(times, values, 120), expected.to_numpy())
+
+def test_ewma_skips_nan():
+    times = np.array([0, 10, 20, 30])
+    values = np.array([np.nan, 2.0, np.nan, 4.0])
+    result = rolling.ewma(times, values, 10)
+    assert np.isnan(result[0]) and result[1] == 2 and result[2] == 2
+    assert np.isclose(result[3], (2 * 0.25 + 4) / 1.25)
+
+def test_unknown_stat():
+    with pytest.raises(ValueError):
+        rolling.trend([0, 1], [0, 1], 1, "mode")
@@ -0,0 +1,42 @@
+###
+# Checks of the streaming pilot log reader in PurpleAir_Analysis/purple_data.py on a
+# joined SD card log written for the test
+###
+
+import os
+import sys
+import datetime
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PurpleAir_Analysis"))
+import purple_data
+
+HEADER = "UTCDateTime,pm2_5_atm,pm2_5_atm_b,gas\n"
+
+def write_log(path, days, per_day = 5):
+    """ A log of per_day samples at 20:00 UTC onwards (midday Pacific) on each of the
+    (month, day) days, with the header repeated before each day as in joined logs """
+    with open(path, "w") as f:
+        for month, day in days:
+            f.write(HEADER)
+            for i in range(per_day):
+                f.write("2019/%02d/%02dT20:%02d:00z,%d,%d\n" % (month, day, 2 * i, 100 * month + day, 100 * month + day + 2))
+    return path
+
+def test_stream_keys_by_date(tmp_path):
+    # the same day of the month in two months must not collide
+    path = write_log(str(tmp_path / "log.csv"), [(10, 10), (10, 11), (11, 10)])
+    dayDict = purple_data.streamDayDict("pm2_5_atm", [path], "average")
+    dates = [datetime.date(2019, 10, 10), datetime.date(2019, 10, 11), datetime.date(2019, 11, 10)]
+    assert sorted(dayDict) == dates
+    assert [dayDict[date].values.tolist() for date in dates] == [[1011] * 5, [1012] * 5, [1111] * 5]
+    assert np.all(np.diff(dayDict[dates[2]].epoch) == 120)
+
+def test_stream_chunks_and_chosen_dates(tmp_path):
+    path = write_log(str(tmp_path / "log.csv"), [(10, 10), (11, 10), (12, 31)], per_day=7)
+    whole = purple_data.streamDayDict("pm2_5_atm", [path])
+    chunked = dict((date, times) for date, times, hours, vals in purple_data.streamDays("pm2_5_atm", [path], chunksize=3))
+    assert sorted(chunked) == sorted(whole)
+    assert all(np.array_equal(chunked[date], whole[date].epoch) for date in whole)
+    chosen = purple_data.pilotDays("pm2_5_atm", [datetime.date(2019, 11, 10)], paths=[path])
+    assert list(chosen) == [datetime.date(2019, 11, 10)] and len(chosen[datetime.date(2019, 11, 10)]) == 7
@@ -0,0 +1,61 @@
+###
+# Checks of common/tail.py on a small SD card style log appended to during the test
+###
+
+import os
+import sys
+import warnings
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import tail
+import timeparse
+
+HEADER = "UTCDateTime,mac_address,pm2_5_atm,rssi,gas\n"
+
+def line(second, pm, rssi = -70):
+    # like the pilot logs, data lines leave off the trailing gas field
+    return "2019/10/23T00:00:%02dz,80:7d:3a:61:5c:fc,%.2f,%d\n" % (second, pm, rssi)
+
+def follow(path):
+    parse_times = lambda df: timeparse.parse_epoch(df["UTCDateTime"], timeparse.SD_CARD_FORMAT)[0]
+    return tail.CsvTail(path, ["pm2_5_atm", "rssi"], parse_times, capacity=8)
+
+def test_poll_skips_merged_lines(tmp_path):
+    path = str(tmp_path / "log.csv")
+    # the logger sometimes starts a line before finishing the last, giving extra fields
+    merged = "2019/10/23T00:00:01z,80:7d:3a:61:5c:fc,2019/10/23T00:00:02z,80:7d:3a:61:5c:fc,0.00,-70\n"
+    with open(path, "w") as f:
+        f.write(HEADER + line(0, 3.61) + merged + line(3, 4.2) + "2019/10/23T00:00:04z,80:7d")
+    follower = follow(path)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert follower.poll() == 2
+    series = follower.buffers["pm2_5_atm"].series()
+    assert series.values.tolist() == np.float32([3.61, 4.2]).tolist()
+    assert follower.buffers["rssi"].series().values.tolist() == [-70, -70]
+    assert np.diff(series.epoch).tolist() == [3]
+
+def test_poll_follows_appended_lines(tmp_path):
+    path = str(tmp_path / "log.csv")
+    with open(path, "w") as f:
+        f.write(HEADER + line(0, 1.0) + "2019/10/23T00:00:01z,80:7d")
+    follower = follow(path)
+    assert follower.poll() == 1
+    assert follower.poll() == 0
+    with open(path, "a") as f:
+        f.write(":3a:61:5c:fc,2.00,-70\n" + "".join(line(s, s) for s in range(2, 12)))
+    assert follower.poll() == 11
+    # the buffer keeps the last capacity samples, oldest first
+    assert follower.buffers["pm2_5_atm"].series().values.tolist() == list(range(4, 12))
+
+def test_poll_restarts_when_the_file_shrinks(tmp_path):
+    path = str(tmp_path / "log.csv")
+    with open(path, "w") as f:
+        f.write(HEADER + line(0, 1.0) + line(1, 2.0))
+    follower = follow(path)
+    assert follower.poll() == 2
+    with open(path, "w") as f:
+        f.write(HEADER + line(5, 9.0))
+    assert follower.poll() == 1
+    assert follower.buffers["pm2_5_atm"].series().values.tolist()[-1] == 9
@@ -0,0 +1,77 @@
+###
+# Checks of common/timegrid.py against a linear scan over the samples for every grid
+# time, on small synthetic signals
+###
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import timegrid
+
+def scan_resample(grid, times, vals, method, tolerance):
+    """ timegrid.resample by scanning the samples in time order for each grid time """
+    order = np.argsort(times, kind="stable")
+    times, vals = np.asarray(times)[order], np.asarray(vals, dtype=float)[order]
+    output = np.full(len(grid), np.nan)
+    for i, t in enumerate(grid):
+        before = [j for j in range(len(times)) if times[j] < t]
+        after = [j for j in range(len(times)) if times[j] >= t]
+        left = before[-1] if before else 0
+        right = after[0] if after else len(times) - 1
+        if method == "nearest":
+            # the earlier sample on a tie
+            best = left if abs(t - times[left]) <= abs(times[right] - t) else right
+            if abs(times[best] - t) <= tolerance:
+                output[i] = vals[best]
+        elif times[right] == t:
+            output[i] = vals[right]
+        elif before and after and times[right] - times[left] <= 2 * tolerance:
+            output[i] = vals[left] + (t - times[left]) / (times[right] - times[left]) * (vals[right] - vals[left])
+    return output
+
+def signal(seed, num_points = 80):
+    rng = np.random.default_rng(seed)
+    times = np.cumsum(rng.choice([1, 60, 120, 120, 400], num_points))
+    vals = rng.normal(size=num_points)
+    vals[rng.random(num_points) < 0.1] = np.nan
+    return times, vals
+
+@pytest.mark.parametrize("method", ["nearest", "linear"])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_resample_matches_scan(method, seed):
+    times, vals = signal(seed)
+    # the grid runs past both ends and hits sample times exactly
+    grid = np.r_[np.arange(times[0] - 500, times[-1] + 500, 37), times[::7]]
+    expected = scan_resample(grid, times, vals, method, 90)
+    assert np.allclose(timegrid.resample(grid, times, vals, method, 90), expected, equal_nan=True)
+
+def test_resample_unsorted_times():
+    times, vals = signal(3)
+    grid = np.arange(times[0], times[-1], 50)
+    shuffle = np.random.default_rng(3).permutation(len(times))
+    assert np.allclose(timegrid.resample(grid, times[shuffle], vals[shuffle]),
+                       timegrid.resample(grid, times, vals), equal_nan=True)
+
+def test_resample_ties_take_earlier_sample():
+    assert timegrid.resample([15], [10, 20], [1.0, 2.0])[0] == 1
+
+def test_resample_empty_and_bad_method():
+    assert np.isnan(timegrid.resample([0, 10], [], [])).all()
+    with pytest.raises(ValueError):
+        timegrid.resample([0], [0], [1.0], "cubic")
+
+def test_window_slices_match_scan():
+    times, vals = signal(4)
+    starts = [times[0] - 10, times[5], times[10] + 1, times[-1]]
+    ends = [times[3], times[5], times[40], times[-1] + 10]
+    for (start, end), pos in zip(zip(starts, ends), timegrid.window_slices(times, starts, ends)):
+        assert list(range(len(times))[pos]) == [j for j in range(len(times)) if start < times[j] < end]
+
+def test_nearest_slice_ends():
+    times = np.array([0, 10, 20, 30])
+    assert timegrid.nearest_slice(times, -100, 100) == slice(0, 4)
+    assert timegrid.nearest_slice(times, 5, 24) == slice(0, 3)
+    assert timegrid.nearest_slice(times, 31, 40) == slice(3, 4)
@@ -0,0 +1,39 @@
+###
+# Checks of the local time handling in common/timeparse.py across the daylight saving
+# changes
+###
+
+import os
+import sys
+from datetime import datetime
+import pytest
+from pytz import timezone
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+import timeparse
+
+FORMAT = "%m/%d/%Y %H:%M"
+
+def pacific(text, is_dst):
+    return int(timezone("US/Pacific").localize(datetime.strptime(text, FORMAT), is_dst=is_dst).timestamp())
+
+def test_repeated_hour_is_kept_in_order():
+    # the clocks go back at 2:00 on 11/1/2020, so 1:00 to 1:59 happen twice
+    times = ["11/1/2020 00:30", "11/1/2020 01:00", "11/1/2020 01:30", "11/1/2020 01:00",
+             "11/1/2020 01:30", "11/1/2020 02:00"]
+    epoch, valid = timeparse.parse_epoch(times, FORMAT, timeparse.LOCAL_TZ)
+    assert valid.all()
+    assert epoch.tolist() == [pacific(times[0], True), pacific(times[1], True), pacific(times[2], True),
+                              pacific(times[3], False), pacific(times[4], False), pacific(times[5], False)]
+    assert (epoch[1:] - epoch[:-1]).tolist() == [1800] * 5
+
+def test_lone_time_in_repeated_hour():
+    epoch, valid = timeparse.parse_epoch(["11/1/2020 01:30"], FORMAT, timeparse.LOCAL_TZ)
+    assert valid.all() and epoch.tolist() == [pacific("11/1/2020 01:30", True)]
+
+def test_skipped_hour_and_bad_times():
+    epoch, valid = timeparse.parse_epoch(["3/8/2020 02:30", "3/8/2020 03:00", "soon"], FORMAT, timeparse.LOCAL_TZ)
+    assert valid.tolist() == [True, True, False]
+    assert epoch[0] == epoch[1] == pacific("3/8/2020 03:00", True)
+    with pytest.raises(ValueError):
+        timeparse.to_epoch(["3/8/2020 03:00", "soon"], FORMAT, timeparse.LOCAL_TZ)